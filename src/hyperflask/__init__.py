@@ -2,6 +2,8 @@ from flask import *
 from .app import Hyperflask
 from .utils.htmx import htmx_redirect, htmx_oob
 from .utils.freezer import StaticMode, static, dynamic
+from .utils.page_cache import cache_page
+from .utils.mercure import mercure_publish_later
 from .security import csp_nonce
 
 # useful exports from hyperflask managed extensions
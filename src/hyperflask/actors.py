@@ -1,6 +1,14 @@
-from threading import local
-from dramatiq import Middleware, actor
+from threading import Event, Lock, local
+from datetime import timedelta
+from dramatiq import Actor, Message, Middleware, Worker, actor
+from dramatiq.brokers.stub import StubBroker
+from .utils.cache import create_cache_store
+import atexit
+import hashlib
 import importlib
+import json
+import os
+import time
 
 
 DRAMATIQ_BROKERS = {
@@ -29,11 +37,72 @@ def discover_broker(broker_cls=None, broker_url=None):
     return broker_cls, broker_url
 
 
+def get_queue_stats(broker, queue_names=None):
+    """Returns the number of messages ready to be processed in the queues of the broker
+    and the age in seconds of the oldest one (None when unknown, eg. with RabbitMQ).
+    """
+    queue_names = [q for q in (queue_names or broker.get_declared_queues()) if not q.endswith((".DQ", ".XQ"))]
+    if not queue_names:
+        return 0, None
+    now = time.time()
+
+    if hasattr(broker, "db"): # sqlite
+        with broker.db as cursor:
+            cursor.execute("SELECT COUNT(*), MIN(mtime) FROM dramatiq_messages WHERE state = 'queued' AND queue_name IN (%s)"
+                           % ", ".join("?" * len(queue_names)), queue_names)
+            count, oldest = cursor.fetchone()
+        return count, now - oldest if oldest else None
+
+    if hasattr(broker, "client"): # redis
+        from dramatiq import Message
+        count, ages = 0, []
+        for queue_name in queue_names:
+            key = f"{broker.namespace}:{queue_name}"
+            count += broker.client.llen(key)
+            oldest_id = broker.client.lindex(key, 0)
+            data = broker.client.hget(f"{key}.msgs", oldest_id) if oldest_id else None
+            if data:
+                ages.append(now - Message.decode(data).message_timestamp / 1000)
+        return count, max(ages, default=None)
+
+    if hasattr(broker, "get_queue_message_counts"): # rabbitmq
+        return sum(broker.get_queue_message_counts(q)[0] for q in queue_names), None
+
+    if hasattr(broker, "queues"): # stub
+        return sum(broker.queues[q].qsize() for q in queue_names if q in broker.queues), None
+    return 0, None
+
+
+def create_local_broker(threads=4, database=None, recovery_timeout=600):
+    """Broker executing messages in the current process with a pool of worker threads.
+    Messages are kept in memory or, when a database filename is given, persisted in SQLite
+    so that pending messages are processed again after a restart.
+    """
+    if database:
+        from dramatiq_sqlite import SQLiteBroker
+        broker = SQLiteBroker(url=database)
+    else:
+        broker = StubBroker()
+    broker.add_middleware(LocalWorkerMiddleware(threads, recovery_timeout))
+    return broker
+
+
+def get_local_worker(broker):
+    return next((m for m in broker.middleware if isinstance(m, LocalWorkerMiddleware)), None)
+
+
 def make_actor_decorator(app):
-    def actor_decorator(**kw):
+    def actor_decorator(batch_size=None, batch_timeout=1.0, **kw):
+        """Declares an actor. With batch_size, the function receives a list of message payloads
+        (the single argument of each message), see BatchCollector.
+        """
         def decorator(fn):
+            if batch_size:
+                fn = BatchCollector(fn, batch_size, batch_timeout)
             if getattr(app, 'dramatiq_broker', None):
                 kw['broker'] = app.dramatiq_broker
+                if kw.get('idempotency_key') or kw.get('result_ttl'):
+                    kw.setdefault('actor_class', IdempotentActor)
                 return actor(**kw)(fn)
             return UndefinedBrokerActor(fn)
         return decorator
@@ -43,13 +112,19 @@ def make_actor_decorator(app):
 class AppContextMiddleware(Middleware):
     # Setup Flask app for actor. Borrowed from
     # https://github.com/Bogdanp/flask_dramatiq_example.
+    # With reuse_context, each worker thread keeps the same app context and only
+    # the teardown functions are run and g is cleared between messages.
 
     state = local()
 
-    def __init__(self, app):
+    def __init__(self, app, reuse_context=False):
         self.app = app
+        self.reuse_context = reuse_context
 
     def before_process_message(self, broker, message):
+        self.state.message = message
+        if self.reuse_context and getattr(self.state, "context", None):
+            return
         context = self.app.app_context()
         context.push()
 
@@ -57,8 +132,13 @@ class AppContextMiddleware(Middleware):
 
     def after_process_message(
             self, broker, message, *, result=None, exception=None):
+        self.state.message = None
         try:
             context = self.state.context
+            if self.reuse_context:
+                self.app.do_teardown_appcontext(exception)
+                vars(context.g).clear()
+                return
             context.pop(exception)
             del self.state.context
         except AttributeError:
@@ -66,6 +146,220 @@ class AppContextMiddleware(Middleware):
 
     after_skip_message = after_process_message
 
+    def before_worker_thread_shutdown(self, broker, thread):
+        context = getattr(self.state, "context", None)
+        if context:
+            context.pop()
+            del self.state.context
+
+    @classmethod
+    def current_message(cls):
+        return getattr(cls.state, "message", None)
+
+
+class IdempotentActor(Actor):
+    """Actor accepting the following options:
+     - idempotency_key: True or a function receiving the message arguments and returning a key.
+       Messages with the same key as a message still waiting in the queue are not enqueued
+       (the pending message is returned instead). Keys expire after dedup_window seconds (default 1 hour).
+     - result_ttl: results of successful runs are kept for this many seconds. Messages with the same key
+       as a memoized run are not enqueued (None is returned) and get_cached_result() returns the result.
+    """
+
+    def make_idempotency_key(self, args=(), kwargs=None):
+        key = self.options.get("idempotency_key") or True
+        if key is True:
+            key = json.dumps([args, kwargs or {}], sort_keys=True, default=str)
+        else:
+            key = str(key(*args, **(kwargs or {})))
+        return f"{self.actor_name}:" + hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+    def send_with_options(self, *, args=(), kwargs=None, delay=None, **options):
+        store = get_actor_store(self.broker)
+        key = self.make_idempotency_key(args, kwargs)
+        if self.options.get("result_ttl") and store.get(f"result:{key}") is not None:
+            return None
+
+        message = self.message_with_options(args=args, kwargs=kwargs, idempotency_key=key, **options)
+        if self.options.get("idempotency_key"):
+            if not store.add(f"pending:{key}", message.encode(), self.options.get("dedup_window", 3600)):
+                pending = store.get(f"pending:{key}")
+                return Message.decode(pending) if pending else None
+        if isinstance(delay, timedelta):
+            delay = int(delay.total_seconds() * 1000)
+        try:
+            return self.broker.enqueue(message, delay=delay)
+        except Exception:
+            store.delete(f"pending:{key}")
+            raise
+
+    def get_cached_result(self, *args, **kwargs):
+        entry = get_actor_store(self.broker).get(f"result:{self.make_idempotency_key(args, kwargs)}")
+        return entry["result"] if entry is not None else None
+
+
+class IdempotencyMiddleware(Middleware):
+    """Releases the idempotency key of messages when they start being processed (so that messages sent
+    while they run are enqueued) or when they are skipped or rejected, and memoizes their results. Keys and results are stored in the
+    cache backend (see create_cache_store()), it must be shared by the processes sending and processing messages.
+    """
+
+    def __init__(self, backend=None, root_path=None):
+        self.backend = backend
+        self.root_path = root_path
+        self.store = None
+
+    @property
+    def actor_options(self):
+        return {"idempotency_key", "dedup_window", "result_ttl"}
+
+    def get_store(self):
+        if self.store is None:
+            store = create_cache_store(self.backend, 10000, self.root_path, "hyperflask:actors:")
+            # the per-process layer of tiered stores is not used as keys are deleted by other processes
+            self.store = getattr(store, "shared_cache", store)
+        return self.store
+
+    def before_process_message(self, broker, message):
+        key = message.options.get("idempotency_key")
+        if key:
+            self.get_store().delete(f"pending:{key}")
+
+    def after_skip_message(self, broker, message):
+        self.release_key(message)
+
+    def after_nack(self, broker, message):
+        # dead-lettered messages will never run
+        self.release_key(message)
+
+    def release_key(self, message):
+        key = message.options.get("idempotency_key")
+        if not key:
+            return
+        store = self.get_store()
+        pending = store.get(f"pending:{key}")
+        # the key may already belong to a message enqueued after this one started
+        if pending and Message.decode(pending).message_id == message.message_id:
+            store.delete(f"pending:{key}")
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        key = message.options.get("idempotency_key")
+        if key and exception is None:
+            ttl = broker.get_actor(message.actor_name).options.get("result_ttl")
+            if ttl:
+                self.get_store().set(f"result:{key}", {"result": result}, ttl)
+
+
+def get_actor_store(broker):
+    return next(m for m in broker.middleware if isinstance(m, IdempotencyMiddleware)).get_store()
+
+
+class BatchCollector:
+    """Groups the messages processed concurrently by the worker threads of a process and calls fn once
+    with the list of their payloads. The first message of a batch waits up to batch_timeout seconds
+    for batch_size messages, the others wait for the batch to be processed, so messages are only acked
+    once fn has run and are all retried if it fails. Batches cannot be larger than the number of worker threads.
+    If fn returns a list of the same length, each message gets its own result.
+    """
+
+    def __init__(self, fn, batch_size, batch_timeout=1.0):
+        self.fn = fn
+        self.__name__ = fn.__name__
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.lock = Lock()
+        self.batch = None
+
+    def __call__(self, payload):
+        if AppContextMiddleware.current_message() is None:
+            # called directly, outside of a worker: a batch of one
+            result = self.fn([payload])
+            if isinstance(result, list) and len(result) == 1:
+                return result[0]
+            return result
+
+        with self.lock:
+            batch = self.batch
+            leader = batch is None
+            if leader:
+                batch = self.batch = Batch()
+            index = len(batch.payloads)
+            batch.payloads.append(payload)
+            if len(batch.payloads) >= self.batch_size:
+                self.batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.batch_timeout)
+            with self.lock:
+                if self.batch is batch:
+                    self.batch = None
+            try:
+                batch.result = self.fn(list(batch.payloads))
+            except Exception as e:
+                batch.exception = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.exception is not None:
+            raise batch.exception
+        if isinstance(batch.result, list) and len(batch.result) == len(batch.payloads):
+            return batch.result[index]
+        return batch.result
+
+
+class Batch:
+    def __init__(self):
+        self.payloads = []
+        self.full = Event()
+        self.done = Event()
+        self.result = None
+        self.exception = None
+
+
+class LocalWorkerMiddleware(Middleware):
+    """Runs a dramatiq worker in the current process, started when the first message is enqueued."""
+
+    def __init__(self, threads=4, recovery_timeout=600):
+        self.threads = threads
+        self.recovery_timeout = recovery_timeout
+        self.worker = None
+        self.pid = None
+        self.lock = Lock()
+
+    def after_enqueue(self, broker, message, delay):
+        self.ensure_started(broker)
+
+    def ensure_started(self, broker):
+        # threads do not survive a fork so each process starts its own worker
+        if self.worker is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.worker is not None and self.pid == os.getpid():
+                return
+            if hasattr(broker, "db"):
+                self.recover_messages(broker)
+            self.worker = Worker(broker, worker_threads=self.threads, worker_timeout=100)
+            self.worker.start()
+            if self.pid is None:
+                atexit.register(self.stop)
+            self.pid = os.getpid()
+
+    def recover_messages(self, broker):
+        # messages consumed by a process which crashed are never acked, they are requeued once they are
+        # older than the time limit of actors (the database may be shared by multiple processes)
+        now = int(time.time())
+        with broker.db as cursor:
+            cursor.execute("UPDATE dramatiq_messages SET state = 'queued', mtime = ? WHERE state = 'consumed' AND mtime < ?",
+                           (now, now - self.recovery_timeout))
+
+    def stop(self, timeout=10000):
+        if self.worker is not None and self.pid == os.getpid():
+            self.worker.stop(timeout)
+            self.worker = None
+
 
 class UndefinedBrokerActor:
     def __init__(self, fn):
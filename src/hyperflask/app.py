@@ -9,19 +9,17 @@ from flask_assets_pipeline import AssetsPipeline, asset_url, static_url
 from flask_super_macros import SuperMacros
 from flask_collections import Collections
 from flask_file_routes import FileRoutes, ModuleView, page
-from flask_configurator import Config
 from flask_babel import Babel, _, _p, _n, _np, lazy_gettext
-from flask_geo import Geolocation
 from flask_files import Files
 from flask_sqlorm import FlaskSQLORM
 from flask_mercure_sse import MercureSSE
+from flask_mailman import Mail
 from flask_mailman_templates import MailTemplates
 from flask_suspense import Suspense, render_template, suspense_before_render_template, suspense_before_render_macros
 #from flask_observability import Observability
 # 3rd party extensions
 from flask_wtf.csrf import CSRFProtect
 from htmx_flask import Htmx
-from flask_mailman import Mail
 from flask_debugtoolbar import DebugToolbarExtension
 # from hyperflask
 from .forms import Form
@@ -30,18 +28,28 @@ from .utils.htmx import htmx_oob, respond_with_flash_messages
 from .utils.markdown import jinja_markdown, MarkdownExtension
 from .utils.html import sanitize_html, nl2br
 from .utils.metadata import metadata_tags
-from .utils.freezer import StaticMode, Freezer, freezer_url_generator
+from .utils.freezer import StaticMode, Freezer, FrozenPages, freezer_url_generator, revalidate_frozen_page
+from .utils.dependencies import Config, Environment
+from .utils.static import send_static
+from .utils.page_cache import PageCache, cache_page, parse_page_cache_option
+from .utils.fragment_cache import CacheExtension
+from .utils.mercure import MercurePublisher, publish_mercure_updates
 from .utils.image import image_tag
-from .components import register_components
+from .utils.startup import StartupProfiler, LazyExtensions
+from .components import register_components, ComponentAdapter
 from .model import Model, File as SQLFileType, UndefinedDatabase
-from .actors import AppContextMiddleware, discover_broker, make_actor_decorator
+from .actors import (AppContextMiddleware, IdempotencyMiddleware, discover_broker, make_actor_decorator,
+                     create_local_broker, get_local_worker)
 from .security import respond_with_security_headers, csp_nonce
+from .health import HealthChecks, check_database, check_broker, check_mercure_hub
+from .metrics import ActorMetricsMiddleware, Metrics, MetricsStore
 from . import page_helpers
 # others
 from jinja_super_macros.registry import FileLoader
 from jinja_wtforms.extractor import map_jinja_call_node_to_func
 from sqlorm.sql_template import SQLTemplate
 from periodiq import PeriodiqMiddleware
+import click
 import os
 
 
@@ -54,22 +62,32 @@ map_jinja_call_node_to_func(lazy_gettext, "lazy_gettext")
 
 class Hyperflask(Flask):
     config_class = Config
+    jinja_environment = Environment
 
     def __init__(self, *args, static_mode=StaticMode.DYNAMIC, instrument=False, layouts_folder="layouts",
                  emails_folder="emails", forms_folder="forms", assets_folder="assets", pages_folder="pages", migrations_folder="migrations",
                  config=None, config_filename="config.yml", database_uri=None, proxy_fix=True, healthcheck_url="/healthcheck", **kwargs):
 
+        self.startup_profiler = StartupProfiler()
         super().__init__(*args, **kwargs)
+        self.extensions = LazyExtensions(self)
+        self.startup_profiler.checkpoint("flask")
         if proxy_fix:
             self.wsgi_app = ProxyFix(self.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 
         self.config.update({
             "FREEZER_DESTINATION": "_site",
-            "FREEZER_STATIC_IGNORE": [],
+            "FREEZER_DESTINATION_IGNORE": ["*.br", "*.zst", "*.gz", ".integrity.json", ".frozen-pages.json", ".revalidating"],
+            "FREEZER_STATIC_IGNORE": ["*.br", "*.zst", "*.gz", ".integrity.json"],
             "FREEZER_IGNORE_404_NOT_FOUND": True,
             "FREEZER_IGNORE_MIMETYPE_WARNINGS": True,
             "FREEZER_REDIRECT_POLICY": "ignore",
             "FREEZER_DEFAULT_FILE_EXTENSION": "html",
+            "FREEZER_INCREMENTAL": False,
+            "FREEZER_MANIFEST_FILE": ".freezer-manifest.json",
+            "FREEZER_PAGES_INDEX": ".frozen-pages.json",
+            "FREEZER_REVALIDATE": None,
+            "FREEZER_REVALIDATE_TIMEOUT": 300,
             "WTF_CSRF_CHECK_DEFAULT": False,
             "OTEL_INSTRUMENT": instrument,
             "DEBUG_TB_INTERCEPT_REDIRECTS": False,
@@ -81,11 +99,16 @@ class Hyperflask(Flask):
             "LAYOUT": "layouts/default.html",
             "ALPINE": False,
             "STATIC_MODE": static_mode,
+            "STATIC_SERVE_FROZEN_PAGES": True,
             "ASSETS_INCLUDE_ALPINE": False,
             "HTMX_EXT": [],
             "HTMX_BOOST_SITE": False,
             "MARKDOWN_OPTIONS": {"extensions": ["fenced_code", "nl2br", "attr_list", "admonition", "codehilite"]},
             "MARKDOWN_SANITIZER_CONFIG": {},
+            "MARKDOWN_CACHE_SIZE": 0,
+            "MARKDOWN_CACHE_FOLDER": None,
+            "MARKDOWN_CACHE_FOLDER_SIZE": 10000,
+            "HTML_SANITIZER_CACHE_SIZE": 0,
             "FLASH_TOAST_OOB": True,
             "FLASH_TOAST_REMOVE_AFTER": None,
             "SERVER_SECURED": False,
@@ -100,6 +123,40 @@ class Hyperflask(Flask):
             "IMAGES_DEFAULT_LOADING": "lazy",
             "IMAGES_DEFAULT_DECODING": "async",
             "HEALTHCHECK_URL": healthcheck_url,
+            "HEALTHCHECK_INTERVAL": 10,
+            "COMPONENTS_MANIFEST_FILE": ".components-manifest.json",
+            "LAZY_EXTENSIONS": [],
+            "PAGE_CACHE": True,
+            "PAGE_CACHE_BACKEND": None,
+            "PAGE_CACHE_SIZE": 1000,
+            "PAGE_CACHE_TIMEOUT": 300,
+            "PAGE_CACHE_LOCAL_TIMEOUT": 10,
+            "PAGE_CACHE_VARY": [],
+            "FRAGMENT_CACHE": True,
+            "FRAGMENT_CACHE_BACKEND": None,
+            "FRAGMENT_CACHE_SIZE": 1000,
+            "FRAGMENT_CACHE_BACKEND_SIZE": 10000,
+            "FRAGMENT_CACHE_TIMEOUT": 300,
+            "FRAGMENT_CACHE_LOCAL_TIMEOUT": 10,
+            "DRAMATIQ_REUSE_APP_CONTEXT": False,
+            "DRAMATIQ_LOCAL_BROKER": True,
+            "DRAMATIQ_LOCAL_BROKER_THREADS": 4,
+            "DRAMATIQ_LOCAL_BROKER_DATABASE": None,
+            "DRAMATIQ_LOCAL_BROKER_RECOVERY_TIMEOUT": 600,
+            "DRAMATIQ_IDEMPOTENCY_BACKEND": "sqlite:.dramatiq-idempotency.db",
+            "METRICS_URL": None,
+            "METRICS_BACKEND": "sqlite:.hyperflask-metrics.db",
+            "METRICS_FLUSH_INTERVAL": 5,
+            "METRICS_RETIRE_AFTER": 3600,
+            "MERCURE_PUBLISH_DEBOUNCE": 0.05,
+            "MERCURE_PUBLISH_BATCH_SIZE": 100,
+            "MERCURE_PUBLISH_POOL_SIZE": 4,
+            "MERCURE_PUBLISH_ACTOR": False,
+            "STATIC_PRECOMPRESS": ["br", "zstd", "gzip"],
+            "STATIC_PRECOMPRESS_MIN_SIZE": 1024,
+            "STATIC_INTEGRITY_MANIFEST": ".integrity.json",
+            "STATIC_IMMUTABLE_PATTERN": r"-[A-Z2-7]{8}\.\w+$",
+            "STATIC_IMMUTABLE_MAX_AGE": 31536000,
         })
         if config:
             self.config.update(config)
@@ -124,12 +181,14 @@ class Hyperflask(Flask):
         if not self.debug and not self.testing and not self.config.get('MERCURE_HUB_URL'):
             self.config['MERCURE_HUB_URL'] = "http://localhost:5300/.well-known/mercure"
             self.config.setdefault('MERCURE_PUBLIC_HUB_URL', True)
+        self.startup_profiler.checkpoint("config")
 
         #self.otel = Observability(self)
 
         self.jinja_env.add_extension(LayoutExtension)
         self.jinja_env.add_extension(WtformExtension)
         self.jinja_env.add_extension(MarkdownExtension)
+        self.jinja_env.add_extension(CacheExtension)
         self.jinja_env.filters.update(markdown=jinja_markdown,
                                       sanitize=sanitize_html,
                                       nl2br=nl2br)
@@ -150,24 +209,43 @@ class Hyperflask(Flask):
             FileLoader(os.path.join(os.path.dirname(__file__), "layouts/web.html"), "layouts/base.html"),
             PrefixLoader({"ui": FileSystemLoader(os.path.join(os.path.dirname(__file__), "ui"))})
         ])
+        self.startup_profiler.checkpoint("jinja")
 
         DebugToolbarExtension(self)
+        self.startup_profiler.checkpoint("debug_toolbar")
         self.freezer = Freezer(self, with_no_argument_rules=False, log_url_for=self.config.get('FREEZER_LOG_URL_FOR', False))
         self.freezer.register_generator(lambda: freezer_url_generator(self))
+        self.startup_profiler.checkpoint("freezer")
         self.csrf = CSRFProtect(self)
+        self.startup_profiler.checkpoint("csrf")
         Htmx(self)
+        self.startup_profiler.checkpoint("htmx")
+        # flask_mailman is imported by flask_mailman_templates anyway, there is nothing to gain making it lazy
         Mail(self)
+        self.startup_profiler.checkpoint("mail")
 
         SuperMacros(self)
         self.components = self.macros # alias
+        self.startup_profiler.checkpoint("macros")
         Babel(self, extract_locale_from_request="locale")
-        Geolocation(self)
+        self.startup_profiler.checkpoint("babel")
+        if "geolocation" in self.config["LAZY_EXTENSIONS"]:
+            self.jinja_env.globals.update(geolocate_country=lazy_geolocate("geolocate_country"),
+                                          geolocate_city=lazy_geolocate("geolocate_city"))
+            self.cli.add_command(lazy_geolocation_command(self))
+        self.init_lazy_extension("geolocation", "flask_geo", init_geolocation)
         Files(self)
+        self.startup_profiler.checkpoint("files")
         MailTemplates(self, template_folder=emails_folder)
+        self.startup_profiler.checkpoint("mail_templates")
         file_routes = FileRoutes(self, pages_folder=pages_folder, module_view_class=HyperModuleView)
         self.page_helper = file_routes.page_helper
+        self.startup_profiler.checkpoint("file_routes")
         self.collections = Collections(self)
+        self.startup_profiler.checkpoint("collections")
         self.sse = MercureSSE(self)
+        self.extensions["mercure_publisher"] = MercurePublisher(self)
+        self.startup_profiler.checkpoint("mercure_sse")
 
         self.assets = AssetsPipeline(self, assets_folder=assets_folder, inline=True, include_inline_on_demand=False,
                                      inline_template_exts=[".html", ".jpy"], tailwind_expand_env_vars=True,
@@ -194,6 +272,7 @@ class Hyperflask(Flask):
         self.assets.include("@hyperflask", 0)
         if self.config["ALPINE"]:
             self.assets.include("@hyperflask/alpine", 0)
+        self.startup_profiler.checkpoint("assets_pipeline")
 
         self.extensions['mail_templates'].jinja_env.add_extension(LayoutExtension)
         self.extensions['mail_templates'].jinja_env.default_layout = "layout.mjml"
@@ -207,20 +286,24 @@ class Hyperflask(Flask):
             self.forms.register_from_loader(file_routes.loader, "pages")
         self.macros.create_from_func(htmx_oob, "HtmxOob", receive_caller=True, caller_alias="html")
         self.macros.create_from_func(image_tag, "Image")
+        self.startup_profiler.checkpoint("ui_macros")
 
-        self.components_loader, _ = register_components(self)
+        self.components_loader, self.component_adapters = register_components(self)
         if self.components_loader:
             self.forms.register_from_loader(self.components_loader)
+        self.startup_profiler.checkpoint("components")
 
         if forms_folder and os.path.isdir(os.path.join(self.root_path, forms_folder)):
             for macro in self.macros.create_from_directory(os.path.join(self.root_path, forms_folder)):
                 self.forms.register(self.macros.resolve_template(macro), macro)
+        self.startup_profiler.checkpoint("forms")
 
         self.after_request(respond_with_security_headers)
         if self.config["FLASH_TOAST_OOB"]:
             self.after_request(respond_with_flash_messages)
 
         self.collections.register_freezer_generator(self.freezer)
+        self.extensions["page_cache"] = PageCache(self)
 
         if self.config.get('SQLORM_URI'):
             SQLTemplate.eval_globals.update(app=self)
@@ -229,15 +312,44 @@ class Hyperflask(Flask):
             self.db.File = SQLFileType
         else:
             self.db = UndefinedDatabase()
+        self.startup_profiler.checkpoint("sqlorm")
 
+        self.metrics = None
+        if self.config["METRICS_URL"]:
+            self.metrics = Metrics(self, MetricsStore(self.config["METRICS_BACKEND"], self.root_path),
+                                   self.config["METRICS_FLUSH_INTERVAL"], self.config["METRICS_RETIRE_AFTER"])
         broker_cls, broker_url = discover_broker(self.config.get('DRAMATIQ_BROKER'), self.config.get('DRAMATIQ_BROKER_URL'))
         if broker_cls:
             self.dramatiq_broker = broker_cls(url=broker_url)
-            self.dramatiq_broker.add_middleware(AppContextMiddleware(self))
+        elif self.config["DRAMATIQ_LOCAL_BROKER"]:
+            local_db = self.config["DRAMATIQ_LOCAL_BROKER_DATABASE"]
+            self.dramatiq_broker = create_local_broker(self.config["DRAMATIQ_LOCAL_BROKER_THREADS"],
+                                                      os.path.join(self.root_path, local_db) if local_db else None,
+                                                      self.config["DRAMATIQ_LOCAL_BROKER_RECOVERY_TIMEOUT"])
+            if local_db:
+                # process messages left over from a previous run without waiting for a new one
+                self.before_request(lambda: get_local_worker(self.dramatiq_broker).ensure_started(self.dramatiq_broker))
+        if getattr(self, 'dramatiq_broker', None):
+            self.dramatiq_broker.add_middleware(AppContextMiddleware(self, self.config["DRAMATIQ_REUSE_APP_CONTEXT"]))
             self.dramatiq_broker.add_middleware(PeriodiqMiddleware())
+            self.dramatiq_broker.add_middleware(IdempotencyMiddleware(self.config["DRAMATIQ_IDEMPOTENCY_BACKEND"],
+                                                                      self.root_path))
+            if self.metrics:
+                self.dramatiq_broker.add_middleware(ActorMetricsMiddleware(self.metrics.store, self.metrics.flush_interval))
         self.actor = make_actor_decorator(self)
+        self.internal_actors = set() # names of the actors registered by hyperflask itself
+        if getattr(self, 'dramatiq_broker', None):
+            if StaticMode(self.config['STATIC_MODE']) == StaticMode.HYBRID and self.config['STATIC_SERVE_FROZEN_PAGES']:
+                # frozen pages are only revalidated when served by FrozenPages
+                self.freezer.revalidate_actor = self.actor(actor_name="revalidate_frozen_page", max_retries=0)(revalidate_frozen_page)
+                self.internal_actors.add("revalidate_frozen_page")
+            if self.config["MERCURE_PUBLISH_ACTOR"]:
+                self.extensions["mercure_publisher"].actor = self.actor(actor_name="publish_mercure_updates")(publish_mercure_updates)
+                self.internal_actors.add("publish_mercure_updates")
+        self.startup_profiler.checkpoint("dramatiq")
 
         Suspense(self, nonce_getter="csp_nonce()")
+        self.startup_profiler.checkpoint("suspense")
 
         @suspense_before_render_template.connect_via(self, weak=False)
         def on_suspense_before_render_template(sender, **kwargs):
@@ -262,16 +374,53 @@ class Hyperflask(Flask):
             except TemplateNotFound:
                 return self.make_response(("500 Internal Server Error", 500))
 
+        self.health = HealthChecks(self, self.config['HEALTHCHECK_INTERVAL'])
+        if not isinstance(self.db, UndefinedDatabase):
+            self.health.register("database", check_database)
+        if getattr(self, 'dramatiq_broker', None):
+            self.health.register("broker", check_broker)
+        if self.config.get('MERCURE_HUB_URL'):
+            self.health.register("mercure_hub", check_mercure_hub, critical=False)
         if self.config['HEALTHCHECK_URL']:
-            @self.route(self.config['HEALTHCHECK_URL'])
-            def healthcheck():
-                if not isinstance(self.db, UndefinedDatabase):
+            self.health.register_routes(self.config['HEALTHCHECK_URL'])
+        if self.metrics:
+            self.metrics.register_routes(self.config['METRICS_URL'])
+
+        if StaticMode(self.config['STATIC_MODE']) == StaticMode.HYBRID and self.config['STATIC_SERVE_FROZEN_PAGES'] \
+           and not self.debug:
+            self.wsgi_app = FrozenPages(self, self.wsgi_app)
+
+    def init_lazy_extension(self, name, key, initializer):
+        """Initializes the extension now or, if listed in LAZY_EXTENSIONS, the first time
+        app.extensions[key] is accessed.
+        """
+        if name in self.config["LAZY_EXTENSIONS"]:
+            self.extensions.register_lazy(key, initializer)
+        else:
+            initializer(self)
+            self.startup_profiler.checkpoint(name)
+
+    def warmup(self):
+        """Compiles templates and component render plans ahead of the first requests
+        (used to preload the app before forking workers).
+        """
+        with self.app_context():
+            for template in self.jinja_env.list_templates(extensions=("html", "jpy")):
+                try:
+                    self.jinja_env.get_template(template)
+                except Exception as e:
+                    self.logger.debug(f"Could not compile template {template} during warmup: {e}")
+            for adapter in self.component_adapters:
+                if isinstance(adapter, ComponentAdapter):
                     try:
-                        with self.db as tx:
-                            tx.execute("SELECT 1")
-                    except Exception:
-                        return {"status": "error"}, 500
-                return {"status": "ok"}
+                        adapter.get_render_plan()
+                    except Exception as e:
+                        self.logger.debug(f"Could not prepare component {adapter.name} during warmup: {e}")
+
+    def send_static_file(self, filename):
+        if not self.has_static_folder:
+            raise RuntimeError("'static_folder' must be set to serve static_files.")
+        return send_static(self.static_folder, filename)
 
     def relative_import_name(self, name):
         return f"{self.import_name}.{name}" if self.import_name != "__main__" else name
@@ -305,8 +454,40 @@ class Hyperflask(Flask):
         return url
 
 
+def init_geolocation(app):
+    from flask_geo import Geolocation
+    Geolocation(app)
+
+
+def lazy_geolocation_command(app):
+    @click.command("download-geo-db", context_settings={"ignore_unknown_options": True, "allow_extra_args": True},
+                   add_help_option=False, help="Download GeoLite2 databases from MaxMind")
+    @click.pass_context
+    def download_geo_db(ctx):
+        # initializing the extension replaces this command with the real one
+        app.extensions["flask_geo"]
+        command = app.cli.commands["download-geo-db"]
+        with command.make_context(ctx.info_name, ctx.args, parent=ctx) as sub_ctx:
+            return command.invoke(sub_ctx)
+    return download_geo_db
+
+
+def lazy_geolocate(name):
+    def geolocate(*args, **kwargs):
+        import flask_geo
+        return getattr(flask_geo, name)(*args, **kwargs)
+    return geolocate
+
+
 class HyperModuleView(ModuleView):
     module_globals = dict(ModuleView.module_globals, asset_url=asset_url, static_url=static_url)
 
+    def as_view(self):
+        view_func = super().as_view()
+        cache = parse_page_cache_option(self.frontmatter, bool(self.module_name))
+        if cache:
+            view_func = cache_page(view_func, timeout=None if cache is True else cache)
+        return view_func
+
     def _render_template(self):
         return render_template(page.template)
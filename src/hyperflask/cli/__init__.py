@@ -2,11 +2,18 @@ from flask import current_app
 from flask.cli import FlaskGroup, shell_command, routes_command, ScriptInfo, NoAppException
 from flask_assets_pipeline import cli as assets_cli
 import click
+import json
+import subprocess
+import sys
+import time
 from ..factory import create_app
 from ..security import generate_csp_policy
 from ..utils.freezer import StaticMode
+from ..utils.startup import parse_importtime
+from ..utils.static import precompress_app_folder
 from .runner import serve_command, run_command, dev_command
 from .worker import worker_command, scheduler_command
+from .mercure import mercure_hub_command, mercure_bench_command
 from .scaffold import gen
 
 
@@ -26,15 +33,49 @@ cli.add_command(run_command)
 cli.add_command(dev_command)
 cli.add_command(worker_command)
 cli.add_command(scheduler_command)
+cli.add_command(mercure_hub_command)
+cli.add_command(mercure_bench_command)
 cli.add_command(gen)
 
 
 @cli.command("build")
+@click.option("--processes", "-p", type=int, default=None, help="Number of processes used to freeze pages.")
 @click.pass_context
-def build_command(ctx):
+def build_command(ctx, processes):
     ctx.invoke(assets_cli.build)
+    if current_app.config['STATIC_PRECOMPRESS'] and current_app.has_static_folder:
+        precompress_app_folder(current_app, current_app.static_folder)
     if StaticMode(current_app.config['STATIC_MODE']) != StaticMode.DYNAMIC:
-        current_app.freezer.freeze()
+        start = time.perf_counter()
+        count = 0
+        for page in current_app.freezer.freeze_yield(processes=processes):
+            count += 1
+            if count % 1000 == 0:
+                click.echo(f"Frozen {count} pages ({count / (time.perf_counter() - start):.1f} pages/s)")
+        duration = time.perf_counter() - start
+        click.echo(f"Frozen {count} pages in {duration:.1f}s ({count / duration if duration else 0:.1f} pages/s)")
+
+
+@cli.command("startup-report", with_appcontext=False)
+@click.option("--limit", default=20, help="Number of imported packages to list.")
+def startup_report_command(limit):
+    """Report the time spent importing packages and initializing extensions when creating the app."""
+    script = ("import json, sys, time; start = time.perf_counter(); from hyperflask.cli import _create_app; "
+              "app = _create_app(); print(json.dumps({'total': time.perf_counter() - start, "
+              "'timings': app.startup_profiler.as_dict()}))")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True)
+    if proc.returncode != 0:
+        click.echo(proc.stderr, err=True)
+        sys.exit(proc.returncode)
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    click.echo(f"App created in {report['total'] * 1000:.1f}ms\n")
+    click.echo("Initialization:")
+    for timing in sorted(report["timings"], key=lambda t: t["duration"], reverse=True):
+        click.echo(f"  {timing['duration'] * 1000:8.1f}ms  {timing['name']} ({timing['kind']})")
+    click.echo("\nImports (self time per top-level package):")
+    for package, duration in parse_importtime(proc.stderr)[:limit]:
+        click.echo(f"  {duration * 1000:8.1f}ms  {package}")
 
 
 @cli.command("csp-header")
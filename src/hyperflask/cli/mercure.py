@@ -0,0 +1,51 @@
+import click
+import logging
+from ..mercure_hub import run_hub, run_benchmark
+
+
+@click.command("mercure-hub")
+@click.option("--host", default="0.0.0.0", help="The interface to bind to.")
+@click.option("--port", default=5300, help="The port to bind to.")
+@click.option("--publisher-secret", envvar="MERCURE_PUBLISHER_SECRET_KEY", required=True, help="Publisher secret key.")
+@click.option("--subscriber-secret", envvar="MERCURE_SUBSCRIBER_SECRET_KEY", required=True, help="Subscriber secret key.")
+@click.option("--allow-anonymous/--no-allow-anonymous", default=True, help="Allow anonymous subscriptions.")
+@click.option("--cors-origins", default="*", help="CORS origins.")
+@click.option("--subscriptions/--no-subscriptions", default=True, help="Enable the subscriptions api.")
+@click.option("--queue-size", default=100, show_default=True,
+              help="Number of pending messages after which a subscriber is dropped.")
+@click.option("--keepalive", default=15, show_default=True, help="Interval in seconds between pings, 0 to disable.")
+@click.option("--debug", is_flag=True)
+def mercure_hub_command(host, port, publisher_secret, subscriber_secret, allow_anonymous, cors_origins, subscriptions,
+                        queue_size, keepalive, debug):
+    """Run an asyncio mercure hub."""
+    logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
+    run_hub(host, port, queue_size, subscriptions=subscriptions, publisher_secret_key=publisher_secret,
+            subscriber_secret_key=subscriber_secret, allow_anonymous=allow_anonymous, cors_origins=cors_origins,
+            keepalive_interval=keepalive)
+
+
+@click.command("mercure-bench")
+@click.option("--url", help="URL of the hub to benchmark (an in-process asyncio hub is started otherwise).")
+@click.option("--publisher-secret", envvar="MERCURE_PUBLISHER_SECRET_KEY", help="Publisher secret key of the hub.")
+@click.option("--subscriber-secret", envvar="MERCURE_SUBSCRIBER_SECRET_KEY", help="Subscriber secret key of the hub.")
+@click.option("--subscribers", "-n", default=1000, show_default=True, help="Number of subscribers.")
+@click.option("--rate", "-m", default=10.0, show_default=True, help="Publishes per second.")
+@click.option("--duration", "-d", default=10.0, show_default=True, help="Duration in seconds.")
+@click.option("--topics", default=1, show_default=True, help="Number of topics, subscribers are spread between them.")
+@click.option("--payload-size", default=100, show_default=True, help="Size of the published data in bytes.")
+@click.option("--queue-size", default=100, show_default=True, help="Subscriber queue size of the in-process hub.")
+def mercure_bench_command(url, publisher_secret, subscriber_secret, subscribers, rate, duration, topics, payload_size,
+                          queue_size):
+    """Simulate subscribers and publishers on a mercure hub and report delivery latencies."""
+    if url and not publisher_secret:
+        raise click.UsageError("--publisher-secret is required to benchmark an external hub")
+    click.echo(f"Running {subscribers} subscribers, {rate} publishes/s for {duration}s...")
+    report = run_benchmark(url, publisher_secret, subscriber_secret, queue_size, subscribers=subscribers, rate=rate,
+                           duration=duration, topics=topics, payload_size=payload_size)
+
+    click.echo(f"Connected subscribers: {report['connected']}/{report['subscribers']} ({report['dropped']} dropped)")
+    click.echo(f"Published: {report['published']} ({report['publish_errors']} errors)")
+    click.echo(f"Delivered: {report['deliveries']}/{report['expected_deliveries']}")
+    click.echo("Latency:")
+    for name, value in report["latency_ms"].items():
+        click.echo(f"  {name:>5}: " + (f"{value:.2f}ms" if value is not None else "-"))
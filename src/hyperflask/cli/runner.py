@@ -3,6 +3,7 @@ import click
 import os
 import sys
 import multiprocessing
+import gc
 import gunicorn.app.base
 from subprocess import Popen
 from honcho.manager import Manager as BaseProcessManager
@@ -18,9 +19,10 @@ from . import reloader # import hacky patch of werkzeug reloader
 @click.command("serve")
 @click.option('--gunicorn-config')
 @click.option("--init-db", is_flag=True)
+@click.option("--preload", is_flag=True, help="Load the app in the master process and share it with workers.")
 @pass_script_info
 @click.pass_context
-def serve_command(ctx, info, host, port, gunicorn_config, init_db, **run_kwargs):
+def serve_command(ctx, info, host, port, gunicorn_config, init_db, preload, **run_kwargs):
     if init_db:
         print("Initializing database...")
         Popen([sys.argv[0], "db", "init"]).wait()
@@ -34,7 +36,8 @@ def serve_command(ctx, info, host, port, gunicorn_config, init_db, **run_kwargs)
         'bind': f'{host}:{port}',
         'workers': 1 + multiprocessing.cpu_count() * 2,
         'max_requests': 1000,
-        'max_requests_jitter': 100
+        'max_requests_jitter': 100,
+        'preload_app': preload
     }, gunicorn_config).run()
 
 
@@ -83,7 +86,10 @@ def run_command(processes, host, port, concurrency, extend_procfile, init_db, gu
         _processes["assets"] = [sys.argv[0], "assets", "dev"]
         _processes["worker"].extend(["-p", "1", "-t", "1"])
     else:
-        _processes["mercurehub"] = [sys.executable, "-m", "flask_mercure_sse.server", "--port", "$PORT"]
+        if config.get("MERCURE_ASYNC_HUB"):
+            _processes["mercurehub"] = [sys.argv[0], "mercure-hub", "--port", "$PORT"]
+        else:
+            _processes["mercurehub"] = [sys.executable, "-m", "flask_mercure_sse.server", "--port", "$PORT"]
 
     if procfile and extend_procfile:
         _processes.update(procfile)
@@ -151,5 +157,64 @@ class GunicornServer(gunicorn.app.base.BaseApplication):
         for key, value in config.items():
             self.cfg.set(key.lower(), value)
 
+        # hooks configured by the user are still called
+        post_worker_init = self.cfg.post_worker_init
+        worker_exit = self.cfg.worker_exit
+        preload_app = self.cfg.preload_app
+
+        def on_post_worker_init(worker):
+            post_worker_init(worker)
+            start_healthchecks(worker)
+            if preload_app:
+                log_worker_memory_usage(worker)
+
+        self.cfg.set("post_worker_init", on_post_worker_init)
+        if preload_app:
+            def on_worker_exit(server, worker):
+                worker_exit(server, worker)
+                log_worker_memory_usage(worker)
+
+            self.cfg.set("worker_exit", on_worker_exit)
+
     def load(self):
-        return self.app_loader()
+        app = self.app_loader()
+        if self.cfg.preload_app:
+            # build everything we can in the master so that workers share it
+            if hasattr(app, "warmup"):
+                app.warmup()
+            # move all objects to a permanent generation so that the gc does not touch
+            # (and thus copy) the shared memory pages in workers
+            gc.collect()
+            gc.freeze()
+        return app
+
+
+def start_healthchecks(worker):
+    # probes run before the first request so that workers are ready when it arrives
+    health = getattr(worker.wsgi, "health", None)
+    if health is not None:
+        health.ensure_started()
+
+
+def log_worker_memory_usage(worker):
+    usage = get_memory_usage(worker.pid)
+    if usage:
+        worker.log.info("Worker %s memory: shared %.1fMB, private %.1fMB", worker.pid,
+                        usage["shared"] / 1024, usage["private"] / 1024)
+
+
+def get_memory_usage(pid):
+    """Returns shared and private memory in kB of a process (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    usage = {"shared": 0, "private": 0}
+    for line in lines:
+        key, _, value = line.partition(":")
+        if key in ("Shared_Clean", "Shared_Dirty"):
+            usage["shared"] += int(value.split()[0])
+        elif key in ("Private_Clean", "Private_Dirty"):
+            usage["private"] += int(value.split()[0])
+    return usage
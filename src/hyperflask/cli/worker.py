@@ -1,8 +1,14 @@
 import click
+import math
+import signal
+import subprocess
 import sys
+import time
+from threading import Event
 from flask import current_app
 from flask.cli import with_appcontext
 import periodiq
+from ..actors import get_local_worker, get_queue_stats
 from dramatiq import set_broker
 from dramatiq.cli import (
     CPUS,
@@ -22,12 +28,40 @@ from dramatiq.cli import (
 @click.option('-Q', '--queues', type=str, default=None,
               metavar='QUEUES', show_default=True,
               help="listen to a subset of queues, comma separated")
+@click.option('--autoscale', metavar='MIN:MAX', default=None,
+              help="scale the number of worker processes between MIN and MAX according to the queues")
+@click.option('--backlog-per-thread', default=10, show_default=True,
+              help="(autoscale) pending messages per worker thread before adding a process")
+@click.option('--max-lag', default=60.0, show_default=True,
+              help="(autoscale) add a process when the oldest pending message is older (in seconds)")
+@click.option('--scale-up-cooldown', default=15.0, show_default=True,
+              help="(autoscale) minimum delay in seconds after scaling before adding processes")
+@click.option('--scale-down-cooldown', default=120.0, show_default=True,
+              help="(autoscale) delay in seconds during which fewer processes must be enough before removing one")
+@click.option('--check-interval', default=5.0, show_default=True,
+              help="(autoscale) interval in seconds between queue checks")
 @with_appcontext
-def worker_command(verbose, processes, threads, queues):
+def worker_command(verbose, processes, threads, queues, autoscale, backlog_per_thread, max_lag, scale_up_cooldown,
+                   scale_down_cooldown, check_interval):
     """Run dramatiq workers.
     """
     check_dramatiq_availability()
 
+    if autoscale:
+        try:
+            min_processes, max_processes = map(int, autoscale.split(":"))
+        except ValueError:
+            raise click.BadParameter("expected MIN:MAX", param_hint="--autoscale")
+        command = [sys.argv[0], "worker", "--processes", "1", "--threads", str(threads)]
+        if verbose:
+            command.append("-v")
+        if queues:
+            command.extend(["--queues", queues])
+        WorkerAutoscaler(command, current_app.dramatiq_broker, queues.split(",") if queues else None,
+                         min_processes, max_processes, threads, backlog_per_thread, max_lag,
+                         scale_up_cooldown, scale_down_cooldown, check_interval).run()
+        return
+
     parser = dramatiq_argument_parser()
 
     command = [
@@ -80,11 +114,98 @@ def scheduler_command(verbose):
     periodiq.main(args)
 
 
+class WorkerAutoscaler:
+    """Supervises single-process worker commands, adding processes when the queues are backed up
+    (too many pending messages per thread or oldest message too old) and removing them one at a time
+    once fewer processes have been enough for the whole scale down cooldown.
+    """
+
+    def __init__(self, command, broker, queues, min_processes, max_processes, threads, backlog_per_thread=10,
+                 max_lag=60, scale_up_cooldown=15, scale_down_cooldown=120, check_interval=5):
+        self.command = command
+        self.broker = broker
+        self.queues = queues
+        self.min_processes = max(0, min_processes)
+        self.max_processes = max(self.min_processes, max_processes)
+        self.threads = threads
+        self.backlog_per_thread = backlog_per_thread
+        self.max_lag = max_lag
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.check_interval = check_interval
+        self.processes = []
+        self.last_scaled = 0
+        self.last_needed = time.monotonic()
+        self.stop_event = Event()
+
+    def desired_processes(self, pending, lag):
+        desired = math.ceil(pending / (self.threads * self.backlog_per_thread))
+        if lag is not None and lag > self.max_lag:
+            desired = max(desired, len(self.processes) + 1)
+        return min(self.max_processes, max(self.min_processes, desired))
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *args: self.stop_event.set())
+        signal.signal(signal.SIGINT, lambda *args: self.stop_event.set())
+        self.scale_to(self.min_processes)
+        try:
+            while not self.stop_event.is_set():
+                self.check()
+                self.stop_event.wait(self.check_interval)
+        finally:
+            self.scale_to(0)
+
+    def check(self):
+        for proc in [p for p in self.processes if p.poll() is not None]:
+            click.echo(f"Worker process {proc.pid} exited with code {proc.returncode}", err=True)
+            self.processes.remove(proc)
+        try:
+            pending, lag = get_queue_stats(self.broker, self.queues)
+        except Exception as e:
+            click.echo(f"Could not check the queues: {e}", err=True)
+            return
+
+        now = time.monotonic()
+        current = len(self.processes)
+        desired = self.desired_processes(pending, lag)
+        if desired >= current:
+            self.last_needed = now
+        if desired > current and (now - self.last_scaled >= self.scale_up_cooldown or current < self.min_processes):
+            click.echo(f"Scaling up to {desired} worker processes ({pending} pending messages, lag {lag or 0:.0f}s)")
+            self.scale_to(desired)
+        elif desired < current and now - self.last_needed >= self.scale_down_cooldown \
+             and now - self.last_scaled >= self.scale_down_cooldown:
+            click.echo(f"Scaling down to {current - 1} worker processes ({pending} pending messages)")
+            self.scale_to(current - 1)
+
+    def scale_to(self, count):
+        while len(self.processes) < count:
+            self.processes.append(subprocess.Popen(self.command))
+        stopping = []
+        while len(self.processes) > count:
+            proc = self.processes.pop() # the most recent process
+            proc.send_signal(signal.SIGTERM) # dramatiq finishes the messages being processed
+            stopping.append(proc)
+        for proc in stopping:
+            try:
+                proc.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.last_scaled = time.monotonic()
+
+
 def check_dramatiq_availability():
     if not getattr(current_app, 'dramatiq_broker', None):
         click.echo("Dramatiq broker is not configured.")
         sys.exit(10)
-    if not current_app.dramatiq_broker.actors:
-        click.echo("No Dramatiq actors found.")
+    if get_local_worker(current_app.dramatiq_broker):
+        click.echo("No Dramatiq broker configured, actors are executed by the web processes.")
         sys.exit(10)
+    user_actors = set(current_app.dramatiq_broker.actors) - current_app.internal_actors
+    if not user_actors:
+        if not current_app.internal_actors:
+            click.echo("No Dramatiq actors found.")
+            sys.exit(10)
+        # messages of these actors would never be processed without a worker
+        click.echo(f"No app actors found, running hyperflask actors only: {', '.join(sorted(current_app.internal_actors))}")
     set_broker(current_app.dramatiq_broker)
@@ -1,16 +1,16 @@
 import jinjapy
 import importlib
 import os
-import importlib
 import re
 from importlib.metadata import entry_points
 from .core import ComponentAdapter
 from .alpine import AlpineAdapter
 from .webcomponent import WebComponentAdapter
 from .jsx import ReactAdapter
+from .manifest import ComponentsManifest, get_class_import_path
 
 
-def discover_components(app, path=None, package_name=None):
+def discover_components(app, path=None, package_name=None, manifest=None):
     if not path:
         path = os.path.join(app.root_path, "components")
         if not os.path.exists(path):
@@ -22,39 +22,67 @@ def discover_components(app, path=None, package_name=None):
     adapters = list(list_available_adapters())
     force_adapters = app.config.get("COMPONENT_ADAPTERS", {})
     components = []
+    filenames = []
 
     loader = jinjapy.register_package(package_name, path, env=app.jinja_env)
     for module_name, template in loader.list_files(module_with_package=False):
         filename = template or (loader.prefix + module_name.replace(".", os.sep) + ".py")
+        file_path = os.path.join(path, filename[len(loader.prefix):])
+        filenames.append(filename)
+        entry = manifest.get(filename, file_path) if manifest else None
         adapter_class = None
         for pattern, adapter_import_path in force_adapters.items():
             if re.match(pattern, filename):
-                adapter_module, adapter_classname = adapter_import_path.split(":")
-                adapter_class = getattr(importlib.import_module(adapter_module), adapter_classname)
+                adapter_class = import_class(adapter_import_path)
                 break
-        if not adapter_class:
+        if not adapter_class and entry:
+            if not entry["adapter"]:
+                continue
+            adapter_class = import_class(entry["adapter"])
+        elif not adapter_class:
             matches = False
             for adapter_class in adapters:
                 if adapter_class.matches(app, module_name, template):
                     matches = True
                     break
             if not matches:
+                if manifest:
+                    manifest.set(filename, file_path, adapter=None)
                 continue
         if adapter_class:
             name = (os.path.basename(template).split(".")[0] if template else module_name.split('.')[-1]).replace("-", "_")
-            adapter = adapter_class(name, f"{package_name}.{module_name}" if module_name else None, template, filename)
+            adapter = adapter_class(name, f"{package_name}.{module_name}" if module_name else None, template, filename, file_path)
+            if entry and entry["adapter"] == get_class_import_path(adapter_class):
+                for attr in adapter.manifest_attrs:
+                    if attr in entry:
+                        setattr(adapter, attr, entry[attr])
             components.append(adapter)
 
+    if manifest:
+        manifest.prune(filenames)
     return loader, components
 
 
 def register_components(app, path=None, package_name=None, url_prefix="/__components/"):
-    loader, adapters = discover_components(app, path, package_name)
+    manifest = None
+    if app.config.get("COMPONENTS_MANIFEST_FILE"):
+        manifest = ComponentsManifest.load(os.path.join(app.root_path, app.config["COMPONENTS_MANIFEST_FILE"]))
+    loader, adapters = discover_components(app, path, package_name, manifest)
     for adapter in adapters:
         adapter.register(app, url_prefix)
+        if manifest:
+            manifest.set(adapter.filename, adapter.path, adapter=get_class_import_path(adapter.__class__),
+                         **{attr: getattr(adapter, attr) for attr in adapter.manifest_attrs})
+    if manifest:
+        manifest.save()
     return loader, adapters
 
 
+def import_class(import_path):
+    module_name, class_name = import_path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
 def list_available_adapters():
     yield AlpineAdapter
     yield WebComponentAdapter
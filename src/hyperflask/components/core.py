@@ -5,31 +5,53 @@ from flask_file_routes import page
 from flask_suspense import render_template
 from jinjapy import extract_frontmatter
 from ..utils.freezer import dynamic
+from ..utils.dependencies import track_dependency
 import importlib
 import re
 
 
 class BaseComponentAdapter:
+    manifest_attrs = () # attributes saved in the components manifest
+
     @classmethod
     def matches(cls, app, module_name, template):
         return False
 
-    def __init__(self, name, module_name, template, filename):
+    def __init__(self, name, module_name, template, filename, path=None):
         self.name = name
         self.module_name = module_name
         self.template = template
         self.filename = filename
+        self.path = path
 
     def register(self, app, url_prefix):
         app.macros.create_from_func(self.render, self.name, receive_caller=True)
 
     def render(self, caller, *args, **kwargs):
-        tpl = current_app.jinja_env.get_template(self.template)
+        tpl = self.get_render_plan().template
         ctx = dict(args=args, kwargs=kwargs, props=kwargs, caller=caller)
         return Markup(tpl.render(**ctx))
 
+    def get_render_plan(self):
+        if self.template:
+            track_dependency("template", self.template)
+        elif self.path:
+            track_dependency("file", self.path)
+        plan = getattr(self, "_render_plan", None)
+        if plan is None or (current_app.jinja_env.auto_reload and not plan.is_up_to_date):
+            plan = self._render_plan = self.compile_render_plan()
+        return plan
+
+    def compile_render_plan(self):
+        template = current_app.jinja_env.get_template(self.template) if self.template else None
+        module = importlib.import_module(self.module_name) if self.module_name else None
+        return ComponentRenderPlan(template, module)
+
 
 class ComponentAdapter(BaseComponentAdapter):
+    manifest_attrs = ("http_methods",)
+    http_methods = None
+
     @classmethod
     def matches(cls, app, module_name, template):
         return module_name or template.endswith(".html") or template.endswith(".jpy")
@@ -39,16 +61,17 @@ class ComponentAdapter(BaseComponentAdapter):
         if not self.module_name:
             return
         url = url_prefix + self.name.replace("_", "/")
-        methods = self.find_supported_http_methods(app)
-        if methods:
-            app.add_url_rule(url, self.name, view_func=self.view_func, methods=methods)
+        if self.http_methods is None:
+            self.http_methods = self.find_supported_http_methods(app)
+        if self.http_methods:
+            app.add_url_rule(url, self.name, view_func=self.view_func, methods=self.http_methods)
 
     @dynamic
     def view_func(self):
         props = {}
         page.template = self.template
-        module = importlib.import_module(self.module_name)
-        m = getattr(module, request.method.lower(), None)
+        plan = self.get_render_plan()
+        m = getattr(plan.module, request.method.lower(), None)
         if m:
             props = m()
             if props is not None and not isinstance(props, dict):
@@ -58,14 +81,14 @@ class ComponentAdapter(BaseComponentAdapter):
         if self.template:
             ctx = self.get_render_context(None, **props)
             return render_template(self.template, **ctx)
-        if "render" in dir(module):
-            return module.render(**props)
+        if plan.render_func:
+            return plan.render_func(**props)
         return ""
 
     def find_supported_http_methods(self, app):
         # avoid importing the module early
         # need to read from filename otherwise frontmatter will be stripped
-        filename = app.jinja_env.loader.get_source(app.jinja_env, self.filename)[1]
+        filename = self.path or app.jinja_env.loader.get_source(app.jinja_env, self.filename)[1]
         with open(filename) as f:
             source, frontmatter = extract_frontmatter(f.read())
             if not self.template:
@@ -80,26 +103,41 @@ class ComponentAdapter(BaseComponentAdapter):
             if caller:
                 kwargs['caller'] = caller
             return Markup(self.call_render_func(*args, **kwargs) or "")
-        tpl = current_app.jinja_env.get_template(self.template)
         ctx = self.get_render_context(caller, *args, **kwargs)
-        return Markup(tpl.render(ctx)) # do not use render_template() so we don't trigger flask signals
+        return Markup(self.get_render_plan().template.render(ctx)) # do not use render_template() so we don't trigger flask signals
 
     def get_render_context(self, caller, *args, **kwargs):
         ctx = kwargs.pop('_ctx', {})
-        ctx.update(dict(args=args, kwargs=kwargs, props=PropsWrapper(kwargs), caller=caller, children=caller))
+        ctx.update(args=args, kwargs=kwargs, props=PropsWrapper(kwargs), caller=caller, children=caller)
         _ctx = self.call_render_func(*args, **kwargs)
         if _ctx:
             ctx.update(_ctx)
         return ctx
 
     def call_render_func(self, *args, **kwargs):
-        if self.module_name:
-            module = importlib.import_module(self.module_name)
-            if module and "render" in dir(module):
-                return module.render(*args, **kwargs)
+        render_func = self.get_render_plan().render_func
+        if render_func:
+            return render_func(*args, **kwargs)
+
+
+class ComponentRenderPlan:
+    """What is needed to render a component, resolved once and reused across renders."""
+
+    __slots__ = ("template", "module", "render_func")
+
+    def __init__(self, template=None, module=None):
+        self.template = template
+        self.module = module
+        self.render_func = getattr(module, "render", None) if module else None
+
+    @property
+    def is_up_to_date(self):
+        return self.template is None or self.template.is_up_to_date
 
 
 class PropsWrapper:
+    __slots__ = ("_props",)
+
     def __init__(self, props):
         self._props = props
 
@@ -0,0 +1,65 @@
+from ..utils.static import write_atomic
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+class ComponentsManifest:
+    """Remembers the outcome of component discovery for each file, keyed by path, mtime and size,
+    so that the next boots do not need to read and scan component files again.
+    """
+
+    def __init__(self, filename, entries=None):
+        self.filename = filename
+        self.entries = entries or {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, filename):
+        try:
+            with open(filename) as f:
+                return cls(filename, json.load(f))
+        except (OSError, ValueError):
+            return cls(filename)
+
+    def get(self, key, path):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry.get("mtime") != stat.st_mtime_ns or entry.get("size") != stat.st_size:
+            return None
+        return entry
+
+    def set(self, key, path, **data):
+        stat = os.stat(path)
+        entry = dict(data, mtime=stat.st_mtime_ns, size=stat.st_size)
+        if self.entries.get(key) != entry:
+            self.entries[key] = entry
+            self.dirty = True
+
+    def prune(self, keys):
+        for key in set(self.entries) - set(keys):
+            del self.entries[key]
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            if os.path.dirname(self.filename):
+                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            write_atomic(self.filename, json.dumps(self.entries, indent=2), "w")
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"Could not write components manifest {self.filename}: {e}")
+
+
+def get_class_import_path(cls):
+    return f"{cls.__module__}:{cls.__qualname__}"
@@ -12,12 +12,12 @@ class WebComponentAdapter(BaseComponentAdapter):
 
     def register(self, app, url_prefix):
         super().register(app, url_prefix)
-        tpl = app.jinja_env.get_template(self.template)
+        filename = self.path or app.jinja_env.get_template(self.template).filename
         if "@components" not in app.assets.state.bundles:
             app.assets.state.bundles["@components"] = []
             app.assets.include("@components")
         app.assets.state.bundles["@components"].append(
-            BundleEntrypoint.create(os.path.abspath(tpl.filename), self.template))
+            BundleEntrypoint.create(os.path.abspath(filename), self.template))
 
     def render(self, caller, *args, **kwargs):
         tag_name = self.name.replace("_", "-")
@@ -47,7 +47,8 @@ def create_app(root_path=None):
 
     if app.config.get("LOAD_HYPERFLASK_EXTENSIONS", True):
         for entry in entry_points(group="hyperflask.extensions"):
-            entry.load()(app)
+            with app.startup_profiler.measure(entry.name, "hyperflask extension"):
+                entry.load()(app)
 
     extensions = {}
     if "FLASK_EXTENSIONS" in app.config:
@@ -55,17 +56,13 @@ def create_app(root_path=None):
 
     for ext, config in extensions.items():
         module, class_name = ext.rsplit(":", 1)
-        m = importlib.import_module(module)
-        getattr(m, class_name)(app, **config)
-
-    try_import(app, "models")
-    try_import(app, "routes")
-    try_import(app, "actors")
-    try_import(app, "tasks")
-    try_import(app, "cron")
-    try_import(app, "cli")
-    try_import(app, "signals")
-    try_import(app, "app")
+        with app.startup_profiler.measure(ext, "flask extension"):
+            m = importlib.import_module(module)
+            getattr(m, class_name)(app, **config)
+
+    for name in ("models", "routes", "actors", "tasks", "cron", "cli", "signals", "app"):
+        with app.startup_profiler.measure(name, "module"):
+            try_import(app, name)
 
     return app
 
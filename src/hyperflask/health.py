@@ -0,0 +1,141 @@
+from flask import current_app
+from threading import Event, Lock, Thread
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from .utils.freezer import dynamic
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class HealthChecks:
+    """Runs dependency probes on a background timer and keeps their last result in memory,
+    so that healthcheck endpoints never block on the dependencies themselves. Probes start when the
+    worker boots (or on the first request). The app is not ready until all critical probes succeeded once
+    (readiness requests wait up to startup_timeout seconds for the first results) and when their results
+    are older than stale_after intervals.
+    """
+
+    def __init__(self, app, interval=10, stale_after=3, startup_timeout=2):
+        self.app = app
+        self.interval = interval
+        self.stale_after = stale_after
+        self.startup_timeout = startup_timeout
+        self.probes = {}
+        self.results = {}
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.thread = None
+        self.pid = None
+
+    def register(self, name, func, critical=True):
+        """Registers a probe: a function raising an exception or returning False when unhealthy.
+        Only critical probes affect readiness.
+        """
+        self.probes[name] = (func, critical)
+
+    def probe(self, name=None, critical=True):
+        def decorator(func):
+            self.register(name or func.__name__, func, critical)
+            return func
+        return decorator
+
+    def run_probes(self):
+        for name, (func, critical) in list(self.probes.items()):
+            start = time.perf_counter()
+            error = None
+            try:
+                with self.app.app_context():
+                    ok = func() is not False
+            except Exception as e:
+                ok = False
+                error = str(e)
+            if not ok and self.results.get(name, {}).get("ok", True):
+                logger.warning(f"Healthcheck probe {name} failed: {error}")
+            self.results[name] = {"ok": ok, "critical": critical, "error": error,
+                                  "duration": time.perf_counter() - start, "checked_at": time.time()}
+
+    def ensure_started(self):
+        # threads do not survive a fork so each worker process starts its own
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stop_event.clear()
+            self.thread = Thread(target=self._loop, name="hyperflask-healthchecks", daemon=True)
+            self.thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_probes()
+            except Exception:
+                logger.exception("Error while running healthcheck probes")
+            if self.stop_event.wait(self.interval):
+                break
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread = None
+
+    def is_ready(self):
+        self.ensure_started()
+        deadline = time.time() + self.startup_timeout
+        while len(self.results) < len(self.probes) and time.time() < deadline:
+            time.sleep(0.05) # first run in progress
+        for name, (func, critical) in list(self.probes.items()):
+            result = self.results.get(name)
+            if critical and (result is None or not result["ok"] or self.is_stale(result)):
+                return False
+        return True
+
+    def is_stale(self, result):
+        # the probes thread died or a probe hangs
+        return result["checked_at"] < time.time() - self.interval * self.stale_after
+
+    def register_routes(self, url):
+        url = url.rstrip("/")
+        # servers without a worker boot hook start the probes on the first request
+        self.app.before_request(self.ensure_started)
+        self.app.add_url_rule(url, "healthcheck", self.live_view)
+        self.app.add_url_rule(f"{url}/live", "healthcheck_live", self.live_view)
+        self.app.add_url_rule(f"{url}/ready", "healthcheck_ready", self.ready_view)
+
+    @dynamic
+    def live_view(self):
+        return {"status": "ok"}
+
+    @dynamic
+    def ready_view(self):
+        ready = self.is_ready()
+        checks = {name: {"ok": r["ok"], "checked_at": r["checked_at"], "stale": self.is_stale(r)}
+                  for name, r in list(self.results.items())}
+        return {"status": "ok" if ready else "error", "checks": checks}, 200 if ready else 500
+
+
+def check_database():
+    with current_app.db as tx:
+        tx.execute("SELECT 1")
+
+
+def check_broker():
+    broker = current_app.dramatiq_broker
+    if hasattr(broker, "client"): # redis
+        broker.client.ping()
+    elif hasattr(broker, "db"): # sqlite
+        with broker.db as cursor:
+            cursor.execute("SELECT 1")
+    elif hasattr(broker, "connection"): # rabbitmq
+        return broker.connection.is_open
+
+
+def check_mercure_hub():
+    try:
+        urlopen(current_app.config["MERCURE_HUB_URL"], timeout=2).close()
+    except HTTPError:
+        pass # the hub responded
@@ -0,0 +1,549 @@
+from flask_mercure_sse.hub import (HubNotAllowed, match_topic_selector, format_sse_msg, format_subscription_event,
+                                   get_subscription_id, format_subscriptions_response)
+from collections import deque
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.cookies import SimpleCookie
+import asyncio
+import json
+import jwt
+import logging
+import multiprocessing
+import secrets
+import socket
+import time
+import typing as t
+import urllib.parse
+import uuid
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+
+HUB_PATH = "/.well-known/mercure"
+MAX_BODY_SIZE = 1024 * 1024
+PING = b":ping\n\n"
+
+
+@dataclass(eq=False)
+class Subscriber:
+    id: str
+    topics: t.List[str]
+    allowed_topics: t.List[str]
+    payload: dict
+    queue: asyncio.Queue
+    close: t.Optional[t.Callable] = None # called when the subscriber is dropped
+    connected_at: float = field(default_factory=time.time)
+
+
+class AsyncHub:
+    """Mercure hub running in an asyncio event loop. Each subscriber has a bounded queue: publishing never
+    waits on subscribers and those whose queue is full (slow clients) are dropped.
+    Same semantics as the hub of flask-mercure-sse.
+    """
+
+    def __init__(self, queue_size=100, reconciliation_length=500, publish_subscriptions=True):
+        self.queue_size = queue_size
+        self.publish_subscriptions = publish_subscriptions
+        self.topics = {}
+        self.subscribers = {}
+        self.last_events = deque(maxlen=reconciliation_length or 0)
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, topics, allowed_topics=None, payload=None, reconciliate_from=None):
+        sub = Subscriber(f"urn:uuid:{uuid.uuid4()}", list(topics), allowed_topics or [], payload or {},
+                         asyncio.Queue(maxsize=self.queue_size))
+        self.subscribers[sub.id] = sub
+        for topic in sub.topics:
+            self.topics.setdefault(topic, {})[sub.id] = sub
+            self.publish_subscription_event(topic, sub)
+
+        if reconciliate_from:
+            events = []
+            for topic, id, msg, private in self.last_events:
+                if id == reconciliate_from:
+                    break
+                if topic in sub.topics:
+                    events.append((topic, msg, private))
+            # only the most recent events fit in the queue
+            for topic, msg, private in reversed(events[:self.queue_size]):
+                self.dispatch(sub, topic, msg, private)
+        return sub
+
+    def unsubscribe(self, sub):
+        if self.subscribers.pop(sub.id, None) is None:
+            return
+        for topic in sub.topics:
+            subs = self.topics.get(topic, {})
+            if subs.pop(sub.id, None) is not None:
+                if not subs:
+                    del self.topics[topic]
+                self.publish_subscription_event(topic, sub, active=False)
+
+    def publish_subscription_event(self, topic, sub, active=True):
+        if self.publish_subscriptions:
+            event = json.dumps(format_subscription_event(topic, sub, active))
+            self.publish(get_subscription_id(topic, sub), event, private=True, type="Subscription")
+            self.publish(get_subscription_id(topic), event, private=True, type="Subscription")
+
+    def publish(self, topic, data, private=False, id=None, type=None, retry=None, allowed_topics=None):
+        if allowed_topics is not None and not any(match_topic_selector(s, topic) for s in allowed_topics):
+            raise HubNotAllowed()
+        if not id:
+            id = f"urn:uuid:{uuid.uuid4()}"
+        # encoded once for all subscribers
+        msg = format_sse_msg(data, id, type, retry).encode("utf-8")
+        if self.last_events.maxlen:
+            self.last_events.appendleft((topic, id, msg, private))
+        self.published += 1
+        for sub in list(self.topics.get(topic, {}).values()):
+            self.dispatch(sub, topic, msg, private)
+        return id
+
+    def dispatch(self, sub, topic, msg, private=False):
+        if private and not any(match_topic_selector(s, topic) for s in sub.allowed_topics):
+            return False
+        try:
+            sub.queue.put_nowait(msg)
+            return True
+        except asyncio.QueueFull:
+            self.drop(sub)
+            return False
+
+    def drop(self, sub):
+        if sub.id not in self.subscribers:
+            return # already dropped
+        logger.debug(f"Dropping slow subscriber {sub.id}")
+        self.dropped += 1
+        self.unsubscribe(sub)
+        if sub.close:
+            sub.close()
+
+    def get_subscriptions(self, topic=None, subscriber=None, allowed_topics=None):
+        if topic:
+            if allowed_topics is not None and not any(match_topic_selector(s, topic) for s in allowed_topics):
+                raise HubNotAllowed()
+            subscriptions = [(topic, self.topics[topic])] if topic in self.topics else []
+            last_event_id = next((e[1] for e in self.last_events if e[0] == topic), "earliest")
+        else:
+            subscriptions = [(topic, subs) for topic, subs in self.topics.items()
+                             if any(match_topic_selector(s, topic) for s in allowed_topics or [])]
+            last_event_id = self.last_events[0][1] if self.last_events else "earliest"
+        if subscriber:
+            subscriptions = [(t, {subscriber: subs[subscriber]}) for t, subs in subscriptions if subscriber in subs]
+        return subscriptions, last_event_id
+
+    @property
+    def stats(self):
+        return {"subscribers": len(self.subscribers), "topics": len(self.topics),
+                "published": self.published, "dropped": self.dropped}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    args: dict
+    headers: dict
+    body: bytes
+
+    def arg(self, name, default=None):
+        return self.args.get(name, [default])[0]
+
+    @property
+    def form(self):
+        return urllib.parse.parse_qs(self.body.decode("utf-8"), keep_blank_values=True)
+
+
+class HubError(Exception):
+    def __init__(self, status):
+        self.status = status
+
+
+class HubServer:
+    """Minimal HTTP/1.1 server exposing an AsyncHub with the mercure protocol (subscriptions as server-sent
+    events, publishing with form-encoded POST requests and the subscriptions api).
+    """
+
+    def __init__(self, hub=None, publisher_secret_key=None, subscriber_secret_key=None, allow_anonymous=True,
+                 allow_publish=True, cors_origins="*", keepalive_interval=15, authz_cookie_name="mercureAuthorization"):
+        self.hub = hub or AsyncHub()
+        self.publisher_secret_key = publisher_secret_key
+        self.subscriber_secret_key = subscriber_secret_key
+        self.allow_anonymous = allow_anonymous
+        self.allow_publish = allow_publish
+        self.cors_origins = cors_origins
+        self.keepalive_interval = keepalive_interval
+        self.authz_cookie_name = authz_cookie_name
+
+    async def start(self, host="0.0.0.0", port=5300, backlog=4096):
+        return await asyncio.start_server(self.handle_connection, host, port, backlog=backlog)
+
+    async def serve_forever(self, host="0.0.0.0", port=5300):
+        server = await self.start(host, port)
+        keepalive = asyncio.create_task(self.keepalive()) if self.keepalive_interval else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if keepalive:
+                keepalive.cancel()
+
+    async def keepalive(self):
+        # a single task pings all subscribers instead of a timeout on each subscriber queue
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            for sub in list(self.hub.subscribers.values()):
+                if sub.queue.empty():
+                    sub.queue.put_nowait(PING)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                try:
+                    if request.method == "OPTIONS":
+                        self.write_response(writer, request, 204)
+                    elif request.path == HUB_PATH and request.method == "GET":
+                        await self.subscribe(request, writer)
+                        break
+                    elif request.path == HUB_PATH and request.method == "POST":
+                        self.publish(request, writer)
+                    elif request.path.startswith(HUB_PATH + "/subscriptions") and request.method == "GET":
+                        self.get_subscriptions(request, writer)
+                    else:
+                        raise HubError(404)
+                except HubError as e:
+                    self.write_response(writer, request, e.status, HTTPStatus(e.status).phrase.encode())
+                await writer.drain()
+                if request.headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def subscribe(self, request, writer):
+        claim = self.get_authorization_jwt(request, self.subscriber_secret_key)
+        if not self.allow_anonymous and not claim:
+            raise HubError(401)
+        topics = request.args.get("topic", [])
+        if not topics:
+            raise HubError(400)
+
+        sub = self.hub.subscribe(topics, claim.get("subscribe", []) if claim else [],
+                                 claim.get("payload") if claim else None,
+                                 request.headers.get("last-event-id", request.arg("lastEventID")))
+        if sub.id not in self.hub.subscribers:
+            raise HubError(503) # dropped while replaying missed events
+        sub.close = writer.transport.abort
+        self.write_head(writer, request, 200, {"Content-Type": "text/event-stream", "Connection": "close",
+                                               "X-Accel-Buffering": "no"})
+        try:
+            await writer.drain()
+            while True:
+                msg = await sub.queue.get()
+                # send everything waiting in the queue with a single write
+                chunks = [msg]
+                while not sub.queue.empty():
+                    chunks.append(sub.queue.get_nowait())
+                writer.write(b"".join(chunks))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.hub.unsubscribe(sub)
+
+    def publish(self, request, writer):
+        if not self.allow_publish:
+            raise HubError(405)
+        claim = self.get_authorization_jwt(request, self.publisher_secret_key)
+        if not claim:
+            raise HubError(401)
+        form = request.form
+        if not form.get("topic"):
+            raise HubError(400)
+
+        data = form.get("data", [""])[0]
+        options = {name: form[name][0] for name in ("id", "type", "retry") if form.get(name)}
+        try:
+            for topic in form["topic"]:
+                id = self.hub.publish(topic, data, private=bool(form.get("private")),
+                                      allowed_topics=claim.get("publish", []), **options)
+        except HubNotAllowed:
+            raise HubError(403)
+        self.write_response(writer, request, 200, id.encode("utf-8"), {"Content-Type": "text/plain"})
+
+    def get_subscriptions(self, request, writer):
+        claim = self.get_authorization_jwt(request, self.subscriber_secret_key)
+        if not claim:
+            raise HubError(401)
+        parts = [urllib.parse.unquote(p) for p in request.path[len(HUB_PATH + "/subscriptions"):].split("/") if p]
+        if len(parts) > 2:
+            raise HubError(404)
+        topic = parts[0] if parts else None
+        subscriber = parts[1] if len(parts) > 1 else None
+        try:
+            subscriptions, last_event_id = self.hub.get_subscriptions(topic, subscriber, claim.get("subscribe", []))
+        except HubNotAllowed:
+            raise HubError(403)
+        if not subscriptions:
+            raise HubError(404)
+
+        id = get_subscription_id(topic) if topic else HUB_PATH + "/subscriptions"
+        if subscriber:
+            id += f"/{urllib.parse.quote(subscriber)}"
+        data = format_subscriptions_response(id, subscriptions, last_event_id)
+        self.write_response(writer, request, 200, json.dumps(data).encode("utf-8"),
+                            {"Content-Type": "application/ld+json"})
+
+    def get_authorization_jwt(self, request, secret):
+        value = None
+        if request.headers.get("authorization", "").startswith("Bearer "):
+            value = request.headers["authorization"][7:]
+        elif self.authz_cookie_name in request.headers.get("cookie", ""):
+            cookie = SimpleCookie(request.headers["cookie"]).get(self.authz_cookie_name)
+            value = cookie.value if cookie else None
+        else:
+            value = request.arg("authorization")
+        if not value:
+            return None
+        try:
+            return jwt.decode(value, secret, ["HS256"]).get("mercure", {})
+        except jwt.PyJWTError as e:
+            logger.debug(f"Invalid mercure jwt: {e}")
+            raise HubError(403)
+
+    def write_head(self, writer, request, status, headers=None):
+        origin = request.headers.get("origin", "*") if self.cors_origins == "*" else self.cors_origins
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+                 "Cache-Control: no-cache, no-store, must-revalidate",
+                 f"Access-Control-Allow-Origin: {origin}",
+                 "Access-Control-Allow-Credentials: true"]
+        if request.method == "OPTIONS":
+            lines.append("Access-Control-Allow-Headers: Authorization, Content-Type, Last-Event-ID, Cache-Control")
+            lines.append("Access-Control-Allow-Methods: GET, POST, OPTIONS")
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    def write_response(self, writer, request, status, body=b"", headers=None):
+        self.write_head(writer, request, status, dict(headers or {}, **{"Content-Length": str(len(body))}))
+        writer.write(body)
+
+
+async def read_request(reader):
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, target, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY_SIZE:
+        raise ValueError("Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    path, _, query = target.partition("?")
+    return Request(method.upper(), path, urllib.parse.parse_qs(query, keep_blank_values=True), headers, body)
+
+
+def run_hub(host="0.0.0.0", port=5300, queue_size=100, reconciliation_length=500, subscriptions=True, **server_kwargs):
+    hub = AsyncHub(queue_size, reconciliation_length, subscriptions)
+    server = HubServer(hub, **server_kwargs)
+    raise_open_files_limit()
+    logger.info(f"Mercure hub listening on http://{host}:{port}{HUB_PATH}")
+    try:
+        asyncio.run(server.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def raise_open_files_limit():
+    # each subscriber is an open connection
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+        except (ValueError, OSError):
+            pass
+
+
+class LoadGenerator:
+    """Simulates subscribers and publishers against a hub and measures the delay between the publishing
+    of an update and its reception by each subscriber.
+    """
+
+    def __init__(self, url, subscribers=1000, rate=10, duration=10, topics=1, publisher_jwt=None, subscriber_jwt=None,
+                 payload_size=100, connect_concurrency=200):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or HUB_PATH
+        self.subscribers = subscribers
+        self.rate = rate
+        self.duration = duration
+        self.topics = [f"bench/{i}" for i in range(topics)]
+        self.publisher_jwt = publisher_jwt
+        self.subscriber_jwt = subscriber_jwt
+        self.padding = "x" * payload_size
+        self.connect_concurrency = connect_concurrency
+        self.latencies = []
+        self.expected_deliveries = 0
+        self.published = 0
+        self.publish_errors = 0
+        self.connected = 0
+        self.disconnected = 0
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.connect_concurrency)
+        ready = [asyncio.get_running_loop().create_future() for _ in range(self.subscribers)]
+        self.subscribers_per_topic = [len(range(i, self.subscribers, len(self.topics))) for i in range(len(self.topics))]
+        tasks = [asyncio.create_task(self.subscriber(self.topics[i % len(self.topics)], semaphore, ready[i]))
+                 for i in range(self.subscribers)]
+        await asyncio.gather(*ready)
+        await self.publisher()
+        await asyncio.sleep(1) # let the last updates be delivered
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.report()
+
+    async def subscriber(self, topic, semaphore, ready):
+        try:
+            async with semaphore:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                query = urllib.parse.urlencode({"topic": topic})
+                auth = f"Authorization: Bearer {self.subscriber_jwt}\r\n" if self.subscriber_jwt else ""
+                writer.write(f"GET {self.path}?{query} HTTP/1.1\r\nHost: {self.host}\r\n{auth}\r\n".encode())
+                status = await reader.readline()
+                while (await reader.readline()).strip():
+                    pass
+            if b" 200 " not in status:
+                raise ConnectionError(status.decode().strip())
+            self.connected += 1
+            ready.set_result(True)
+            buffer = b""
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    self.disconnected += 1 # dropped by the hub
+                    break
+                now = time.time()
+                *events, buffer = (buffer + chunk).split(b"\n\n")
+                for event in events:
+                    start = event.find(b"data: ")
+                    if start != -1:
+                        self.latencies.append(now - float(event[start + 6:event.index(b" ", start + 6)]))
+        except asyncio.CancelledError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.debug(f"Subscriber error: {e}")
+        finally:
+            if not ready.done():
+                ready.set_result(False)
+
+    async def publisher(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        interval = 1 / self.rate
+        start = time.perf_counter()
+        try:
+            while time.perf_counter() - start < self.duration:
+                index = (self.published + self.publish_errors) % len(self.topics)
+                body = urllib.parse.urlencode({"topic": self.topics[index],
+                                               "data": f"{time.time()} {self.padding}"}).encode()
+                writer.write((f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                              f"Authorization: Bearer {self.publisher_jwt}\r\n"
+                              "Content-Type: application/x-www-form-urlencoded\r\n"
+                              f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+                status = await reader.readline()
+                length = 0
+                while line := (await reader.readline()).strip():
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                await reader.readexactly(length)
+                if b" 200 " in status:
+                    self.published += 1
+                    self.expected_deliveries += self.subscribers_per_topic[index]
+                else:
+                    self.publish_errors += 1
+                # publishes are scheduled at a fixed rate, not a fixed delay
+                delay = start + (self.published + self.publish_errors) * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        finally:
+            writer.close()
+
+    def report(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else None
+
+        return {
+            "subscribers": self.subscribers,
+            "connected": self.connected,
+            "dropped": self.disconnected,
+            "published": self.published,
+            "publish_errors": self.publish_errors,
+            "expected_deliveries": self.expected_deliveries,
+            "deliveries": len(latencies),
+            "latency_ms": {"p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99),
+                           "p999": percentile(0.999), "max": latencies[-1] * 1000 if latencies else None},
+        }
+
+
+def run_benchmark(url=None, publisher_secret_key=None, subscriber_secret_key=None, queue_size=100, **kwargs):
+    """Runs the load generator against the hub at url or, without url, against an asyncio hub started
+    in a separate process (so that the load generator does not compete with the hub for the event loop).
+    """
+    raise_open_files_limit()
+    process = None
+    publisher_secret_key = publisher_secret_key or secrets.token_urlsafe(32)
+    subscriber_secret_key = subscriber_secret_key or publisher_secret_key
+    if not url:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        process = multiprocessing.get_context("spawn").Process(target=run_hub, daemon=True, args=("127.0.0.1", port),
+            kwargs=dict(queue_size=queue_size, subscriptions=False, publisher_secret_key=publisher_secret_key,
+                        subscriber_secret_key=subscriber_secret_key))
+        process.start()
+        wait_for_port("127.0.0.1", port)
+        url = f"http://127.0.0.1:{port}{HUB_PATH}"
+
+    generator = LoadGenerator(url,
+                              publisher_jwt=jwt.encode({"mercure": {"publish": ["*"]}}, publisher_secret_key, algorithm="HS256"),
+                              subscriber_jwt=jwt.encode({"mercure": {"subscribe": ["*"]}}, subscriber_secret_key, algorithm="HS256"),
+                              **kwargs)
+    try:
+        return asyncio.run(generator.run())
+    finally:
+        if process:
+            process.terminate()
+            process.join()
+
+
+def wait_for_port(host, port, timeout=10):
+    start = time.monotonic()
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() - start > timeout:
+                raise
+            time.sleep(0.05)
@@ -0,0 +1,350 @@
+from flask import current_app
+from dramatiq import Middleware
+from threading import Event, Lock, Thread, local
+from .actors import get_queue_stats
+from .utils.freezer import dynamic
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS, counts=None, sum=0):
+        self.buckets = buckets
+        self.counts = counts or [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = sum
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+
+    def as_dict(self):
+        return {"counts": self.counts, "sum": self.sum}
+
+    @classmethod
+    def from_dict(cls, data, buckets=DEFAULT_BUCKETS):
+        return cls(buckets, list(data["counts"]), data["sum"])
+
+
+class ActorStats:
+    COUNTERS = ("processed", "failed", "retried", "skipped")
+
+    def __init__(self, data=None):
+        data = data or {}
+        for name in self.COUNTERS:
+            setattr(self, name, data.get(name, 0))
+        self.in_flight = data.get("in_flight", 0)
+        self.duration = Histogram.from_dict(data["duration"]) if "duration" in data else Histogram()
+        self.queue_wait = Histogram.from_dict(data["queue_wait"]) if "queue_wait" in data else Histogram()
+
+    def merge(self, other, with_gauges=True):
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        if with_gauges:
+            self.in_flight += other.in_flight
+        self.duration.merge(other.duration)
+        self.queue_wait.merge(other.queue_wait)
+
+    def as_dict(self):
+        return dict({name: getattr(self, name) for name in self.COUNTERS}, in_flight=self.in_flight,
+                    duration=self.duration.as_dict(), queue_wait=self.queue_wait.as_dict())
+
+
+class MetricsStore:
+    """Keeps the latest snapshot of the metrics of each process in SQLite or Redis (backend is
+    "sqlite:path/to/file.db" or a redis url) so that they can be aggregated by any process.
+    Snapshots of processes which stopped saving them are merged into a single "retired" entry
+    so that counters never decrease.
+    """
+
+    RETIRED = "retired"
+
+    def __init__(self, backend, root_path=None, prefix="hyperflask:"):
+        self.redis = None
+        self.local = local()
+        if backend.startswith(("redis://", "rediss://", "unix://")):
+            if redis is None:
+                raise RuntimeError("The redis package is required to store metrics in redis")
+            self.redis = redis.Redis.from_url(backend)
+            self.key = f"{prefix}metrics"
+            return
+        if not backend.startswith("sqlite:"):
+            raise ValueError(f"Unknown metrics backend '{backend}'")
+        filename = backend[len("sqlite:"):]
+        if filename.startswith("//"):
+            filename = filename[2:]
+        if root_path and not os.path.isabs(filename):
+            filename = os.path.join(root_path, filename)
+        self.filename = filename
+
+    def connect(self):
+        # connections cannot be shared between threads or forked processes
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = self.local.conn = sqlite3.connect(self.filename, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS metrics (process TEXT PRIMARY KEY, data TEXT, updated REAL)")
+            self.local.pid = os.getpid()
+        return conn
+
+    def save(self, process, data):
+        value = json.dumps({"data": data, "updated": time.time()})
+        if self.redis is not None:
+            self.redis.hset(self.key, process, value)
+        else:
+            self.connect().execute("INSERT OR REPLACE INTO metrics (process, data, updated) VALUES (?, ?, ?)",
+                                   (process, value, time.time()))
+
+    def load_all(self):
+        """Returns a list of (data, updated) for all processes."""
+        if self.redis is not None:
+            values = self.redis.hgetall(self.key).values()
+        else:
+            values = [row[0] for row in self.connect().execute("SELECT data FROM metrics")]
+        return [(v["data"], v["updated"]) for v in map(json.loads, values)]
+
+    def retire(self, before, merge):
+        """Merges the snapshots saved before the given time with merge(list of snapshots)."""
+        if self.redis is not None:
+            self._retire_redis(before, merge)
+            return
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT process, data FROM metrics WHERE updated < ? AND process != ?",
+                                (before, self.RETIRED)).fetchall()
+            if rows:
+                retired = conn.execute("SELECT data FROM metrics WHERE process = ?", (self.RETIRED,)).fetchone()
+                snapshots = [json.loads(data)["data"] for _, data in rows]
+                if retired:
+                    snapshots.append(json.loads(retired[0])["data"])
+                # retired gauges are ignored as the entry is never updated
+                conn.execute("INSERT OR REPLACE INTO metrics (process, data, updated) VALUES (?, ?, 0)",
+                             (self.RETIRED, json.dumps({"data": merge(snapshots), "updated": 0})))
+                conn.executemany("DELETE FROM metrics WHERE process = ?", [(process,) for process, _ in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _retire_redis(self, before, merge):
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(self.key)
+                entries = {k.decode(): json.loads(v) for k, v in pipe.hgetall(self.key).items()}
+                expired = [k for k, v in entries.items() if k != self.RETIRED and v["updated"] < before]
+                if not expired:
+                    return
+                snapshots = [entries[k]["data"] for k in expired]
+                if self.RETIRED in entries:
+                    snapshots.append(entries[self.RETIRED]["data"])
+                pipe.multi()
+                pipe.hset(self.key, self.RETIRED, json.dumps({"data": merge(snapshots), "updated": 0}))
+                pipe.hdel(self.key, *expired)
+                pipe.execute()
+            except redis.WatchError:
+                pass # a process saved its metrics meanwhile, retired on the next call
+
+
+class ActorMetricsMiddleware(Middleware):
+    """Records per actor execution time and queue wait time histograms, processed, failed, retried and
+    skipped messages and in-flight messages. Each process periodically saves its metrics in the store.
+    """
+
+    def __init__(self, store, flush_interval=5):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.stats = {}
+        self.starts = {}
+        self.lock = Lock()
+        self.process_id = None
+        self.thread = None
+        self.stop_event = Event()
+
+    def get_stats(self, actor_name):
+        if actor_name not in self.stats:
+            self.stats[actor_name] = ActorStats()
+        return self.stats[actor_name]
+
+    def before_process_message(self, broker, message):
+        now = time.time()
+        # the wait of delayed messages starts once their delay has expired
+        enqueued_at = message.options.get("eta", message.message_timestamp) / 1000
+        with self.lock:
+            stats = self.get_stats(message.actor_name)
+            stats.in_flight += 1
+            stats.queue_wait.observe(max(0, now - enqueued_at))
+            if message.options.get("retries"):
+                stats.retried += 1
+            self.starts[message.message_id] = time.perf_counter()
+        self.ensure_started()
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        with self.lock:
+            start = self.starts.pop(message.message_id, None)
+            stats = self.get_stats(message.actor_name)
+            stats.in_flight -= 1
+            if start is not None:
+                stats.duration.observe(time.perf_counter() - start)
+            if exception is None:
+                stats.processed += 1
+            else:
+                stats.failed += 1
+
+    def after_skip_message(self, broker, message):
+        with self.lock:
+            stats = self.get_stats(message.actor_name)
+            # messages skipped by an earlier middleware (eg. AgeLimit) never started
+            if self.starts.pop(message.message_id, None) is not None:
+                stats.in_flight -= 1
+            stats.skipped += 1
+
+    def after_worker_shutdown(self, broker, worker):
+        self.stop_event.set()
+        self.flush()
+
+    def ensure_started(self):
+        # threads do not survive a fork so each worker process starts its own
+        if self.thread is not None and self.process_id == self.get_process_id():
+            return
+        with self.lock:
+            if self.thread is not None and self.process_id == self.get_process_id():
+                return
+            if self.process_id is not None:
+                self.stats = {} # metrics inherited from the parent process
+            self.process_id = self.get_process_id()
+            self.stop_event.clear()
+            self.thread = Thread(target=self._loop, name="hyperflask-actor-metrics", daemon=True)
+            self.thread.start()
+
+    def _loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            data = {name: stats.as_dict() for name, stats in self.stats.items()}
+        if not data:
+            return
+        try:
+            self.store.save(self.process_id or self.get_process_id(), data)
+        except Exception:
+            logger.exception("Could not save actor metrics")
+
+    @staticmethod
+    def get_process_id():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Metrics:
+    """Exposes metrics in the Prometheus text format: actor metrics aggregated from all processes
+    and the depth of the queues.
+    """
+
+    def __init__(self, app, store=None, flush_interval=5, retire_after=3600):
+        self.app = app
+        self.store = store
+        self.flush_interval = flush_interval
+        self.retire_after = retire_after
+
+    def register_routes(self, url):
+        self.app.add_url_rule(url, "metrics", self.metrics_view)
+
+    @dynamic
+    def metrics_view(self):
+        return "\n".join(self.render()) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    def aggregate_actor_stats(self):
+        if not self.store:
+            return {}
+        if self.retire_after:
+            try:
+                self.store.retire(time.time() - self.retire_after, merge_snapshots)
+            except Exception as e:
+                current_app.logger.warning(f"Could not retire metrics of stopped processes: {e}")
+        actors = {}
+        # gauges of processes which stopped saving their metrics are ignored
+        stale = time.time() - self.flush_interval * 3
+        for data, updated in self.store.load_all():
+            for name, values in data.items():
+                actors.setdefault(name, ActorStats()).merge(ActorStats(values), with_gauges=updated >= stale)
+        return actors
+
+    def render(self):
+        lines = []
+        actors = self.aggregate_actor_stats()
+        for name, help, attr in (("processed", "Messages processed successfully", "processed"),
+                                 ("failed", "Messages which raised an exception", "failed"),
+                                 ("retried", "Messages processed again after a failure", "retried"),
+                                 ("skipped", "Messages skipped by a middleware", "skipped")):
+            lines.append(f"# HELP hyperflask_actor_messages_{name}_total {help}")
+            lines.append(f"# TYPE hyperflask_actor_messages_{name}_total counter")
+            lines.extend(f'hyperflask_actor_messages_{name}_total{{actor="{actor}"}} {getattr(stats, attr)}'
+                         for actor, stats in actors.items())
+        lines.append("# HELP hyperflask_actor_messages_in_flight Messages being processed")
+        lines.append("# TYPE hyperflask_actor_messages_in_flight gauge")
+        lines.extend(f'hyperflask_actor_messages_in_flight{{actor="{actor}"}} {stats.in_flight}'
+                     for actor, stats in actors.items())
+        for name, help, attr in (("duration", "Execution time of messages", "duration"),
+                                 ("queue_wait", "Time between the enqueueing and the processing of messages", "queue_wait")):
+            lines.append(f"# HELP hyperflask_actor_{name}_seconds {help}")
+            lines.append(f"# TYPE hyperflask_actor_{name}_seconds histogram")
+            for actor, stats in actors.items():
+                lines.extend(format_histogram(f"hyperflask_actor_{name}_seconds", getattr(stats, attr), f'actor="{actor}"'))
+
+        broker = getattr(self.app, "dramatiq_broker", None)
+        if broker:
+            try:
+                pending, lag = get_queue_stats(broker)
+                lines.append("# HELP hyperflask_queue_pending_messages Messages waiting in the queues")
+                lines.append("# TYPE hyperflask_queue_pending_messages gauge")
+                lines.append(f"hyperflask_queue_pending_messages {pending}")
+                if lag is not None:
+                    lines.append("# HELP hyperflask_queue_lag_seconds Age of the oldest message waiting in the queues")
+                    lines.append("# TYPE hyperflask_queue_lag_seconds gauge")
+                    lines.append(f"hyperflask_queue_lag_seconds {lag:.3f}")
+            except Exception as e:
+                current_app.logger.warning(f"Could not read queue stats for metrics: {e}")
+        return lines
+
+
+def merge_snapshots(snapshots):
+    actors = {}
+    for data in snapshots:
+        for name, values in data.items():
+            actors.setdefault(name, ActorStats()).merge(ActorStats(values), with_gauges=False)
+    return {name: stats.as_dict() for name, stats in actors.items()}
+
+
+def format_histogram(name, histogram, labels):
+    lines = []
+    total = 0
+    for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+        total += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {total}")
+    return lines
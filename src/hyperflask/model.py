@@ -1,9 +1,12 @@
-from flask import current_app
+from flask import current_app, has_app_context
 from flask_sqlorm import Model as BaseModel
 from flask_files import save_file, File
+from sqlorm import Model as BaseSQLORMModel
 from sqlorm.resultset import CompositeResultSet
 from sqlorm import SQLType
 from markupsafe import Markup
+from .utils.dependencies import track_dependency
+from .utils.mercure import get_mercure_publisher
 import abc
 import os
 import fcntl
@@ -14,7 +17,18 @@ File = SQLType("text", save_file, File.from_uri)
 
 class ModelResultSet(CompositeResultSet):
     def __str__(self):
-        return Markup("".join([str(item) for item in self]))
+        return Markup("".join(self.render()))
+
+    def render(self):
+        """Yields the html of each object, resolving the render macro only once per model class.
+        Can be used to stream large listings.
+        """
+        renderers = {}
+        for item in self:
+            cls = item.__class__
+            if cls not in renderers:
+                renderers[cls] = cls.get_renderer() if isinstance(item, Model) else str
+            yield renderers[cls](item)
 
 
 class ModelMercureTopic:
@@ -36,21 +50,44 @@ class Model(BaseModel, abc.ABC):
     __resultset_class__ = ModelResultSet
     __macro__ = None
     __mercure_sse_topic__ = ModelMercureTopic()
+    __mercure_publish_changes__ = False # publish inserted and updated objects using the mercure publishing queue
 
     def __mercure_sse_data__(self):
         return str(self)
 
     def __str__(self):
-        if not self.__macro__:
-            return repr(self)
+        return self.get_renderer()(self)
+
+    @classmethod
+    def get_renderer(cls):
+        """Returns a function rendering an object of this model to html using __macro__."""
+        if not cls.__macro__:
+            return repr
 
-        macro = self.__macro__
+        macro = cls.__macro__
         prop = "obj"
         if "(" in macro:
             macro, prop = macro.rstrip(")").rsplit("(")
 
-        props = {prop: self} if prop else {}
-        return Markup(current_app.macros[macro](**props))
+        # resolve the macro function once instead of looking up the registry and template for each object
+        call = current_app.macros[macro]
+        func = getattr(current_app.jinja_env.get_template(call.template).module, call.macro_name)
+        if prop:
+            return lambda obj: Markup(func(**{prop: obj}))
+        return lambda obj: Markup(func())
+
+
+@BaseSQLORMModel.before_query.connect
+def track_model_query(sender, **kwargs):
+    # used to tag cached pages with the models they display
+    track_dependency("model", sender.__name__)
+
+
+@BaseSQLORMModel.after_insert.connect
+@BaseSQLORMModel.after_update.connect
+def publish_model_changes(sender, obj=None, **kwargs):
+    if obj is not None and getattr(sender, "__mercure_publish_changes__", False) and has_app_context():
+        get_mercure_publisher().publish_model(obj)
 
 
 def init_db_locked(app):
@@ -74,3 +111,4 @@ def init_db_locked(app):
 class UndefinedDatabase:
     def __getattr__(self, item):
         raise RuntimeError("No database defined for the application.")
+
@@ -1,8 +1,11 @@
-from flask import request, current_app, g
+from flask import request, current_app, g, has_request_context
 from urllib.parse import urlparse, urljoin
 import secrets
 
 
+CSP_NONCE_MARKER = "\0nonce\0"
+
+
 def is_safe_redirect_url(target):
     host_url = urlparse(request.host_url)
     redirect_url = urlparse(urljoin(request.host_url, target))
@@ -27,31 +30,70 @@ def respond_with_security_headers(response):
     return response
 
 
-def generate_csp_policy():
-    policy = current_app.config["CSP_HEADER"]
+def generate_csp_policy(endpoint=None):
+    if endpoint is None and has_request_context():
+        endpoint = request.endpoint
+    nonce = g.get('csp_nonce')
+    return compile_csp_policy(current_app, endpoint, nonce is not None).render(nonce)
+
+
+class CompiledCSPPolicy:
+    """The static part of a CSP header, split where the per-request nonce must be inserted."""
+
+    __slots__ = ("parts",)
+
+    def __init__(self, policy):
+        self.parts = policy.split(CSP_NONCE_MARKER)
+
+    def render(self, nonce=None):
+        if len(self.parts) == 1:
+            return self.parts[0]
+        return nonce.join(self.parts)
+
+
+def compile_csp_policy(app, endpoint=None, with_nonce=False):
+    """Returns the compiled policy for this combination, building it on first use.
+    Use clear_csp_policy_cache() if the CSP configuration changes at runtime.
+    """
+    cache = app.extensions.setdefault('csp_policies', {})
+    key = (endpoint, app.debug, app.config['SERVER_SECURED'], with_nonce)
+    compiled = cache.get(key)
+    if compiled is None:
+        compiled = cache[key] = CompiledCSPPolicy(build_csp_policy(app, endpoint, with_nonce))
+    return compiled
+
+
+def clear_csp_policy_cache(app):
+    app.extensions.pop('csp_policies', None)
+
+
+def build_csp_policy(app, endpoint=None, with_nonce=False):
+    policy = app.config["CSP_HEADER"]
     if policy is True:
         policy = {
             "default-src": "'safe-src'",
             "manifest-src": "'self'",
-            "connect-src": 'https: wss:' if current_app.config['SERVER_SECURED'] else 'http: ws:',
+            "connect-src": 'https: wss:' if app.config['SERVER_SECURED'] else 'http: ws:',
             "img-src": "* data: blob:",
             "media-src": "* data: blob:",
             "frame-src": "* data: blob:",
             "object-src": "* data: blob:"
         }
+    else:
+        policy = dict(policy)
     policy.setdefault("script-src", policy["default-src"])
     policy.setdefault("style-src", policy["default-src"])
 
-    if not current_app.config['CSP_FRAME_ANCESTORS']:
+    if not app.config['CSP_FRAME_ANCESTORS']:
         policy["frame-ancestors"] = "'none'"
-    elif isinstance(current_app.config['CSP_FRAME_ANCESTORS'], (list, tuple)):
-        frame_ancestors = list(current_app.config['CSP_FRAME_ANCESTORS'])
+    elif isinstance(app.config['CSP_FRAME_ANCESTORS'], (list, tuple)):
+        frame_ancestors = list(app.config['CSP_FRAME_ANCESTORS'])
         add_frame_ancestors = True
-        for endpoint in current_app.config['CSP_FRAME_ANCESTORS_SAFE_ENDPOINTS']:
+        for safe_endpoint in app.config['CSP_FRAME_ANCESTORS_SAFE_ENDPOINTS']:
             ancestors = []
-            if isinstance(endpoint, (list, tuple)):
-                endpoint, ancestors = endpoint
-            if request.endpoint == endpoint:
+            if isinstance(safe_endpoint, (list, tuple)):
+                safe_endpoint, ancestors = safe_endpoint
+            if endpoint == safe_endpoint:
                 if ancestors:
                     frame_ancestors.extend(ancestors)
                 else:
@@ -60,18 +102,18 @@ def generate_csp_policy():
         if add_frame_ancestors:
             policy["frame-ancestors"] = ' '.join(set(frame_ancestors))
 
-    if current_app.config.get('CSP_UNSAFE_EVAL'):
+    if app.config.get('CSP_UNSAFE_EVAL'):
         policy["script-src"] += " 'unsafe-eval'"
 
-    unsafe_inline = current_app.debug or current_app.config.get('CSP_UNSAFE_INLINE')
+    unsafe_inline = app.debug or app.config.get('CSP_UNSAFE_INLINE')
     if unsafe_inline:
         policy["script-src"] += " 'unsafe-inline'"
         policy["style-src"] += " 'unsafe-inline'"
-    elif 'csp_nonce' in g:
-        policy["style-src"] += f" 'nonce-{g.csp_nonce}'"
-        policy["script-src"] += f" 'nonce-{g.csp_nonce}'"
+    elif with_nonce:
+        policy["style-src"] += f" 'nonce-{CSP_NONCE_MARKER}'"
+        policy["script-src"] += f" 'nonce-{CSP_NONCE_MARKER}'"
 
-    safe_srcs = " ".join(set(current_app.config['CSP_SAFE_SRC']))
+    safe_srcs = " ".join(set(app.config['CSP_SAFE_SRC']))
     return "; ".join(("%s %s" % (k, v.replace("'safe-src'", safe_srcs))).strip() for k, v in policy.items()) + ";"
 
 
@@ -0,0 +1,247 @@
+from collections import OrderedDict
+from threading import Lock, local
+import os
+import pickle
+import sqlite3
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class MemoryCache:
+    """Per-process LRU cache with optional expiration. Counters (incr) are never evicted."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return self.counters.get(key)
+            value, expires = item
+            if expires and expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self.entries[key] = (value, time.time() + timeout if timeout else None)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def add(self, key, value, timeout=None):
+        """Sets the value only if the key does not exist, returns whether it was set."""
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None and (not item[1] or item[1] >= time.time()):
+                return False
+        self.set(key, value, timeout)
+        return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.counters.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteCache:
+    """Cache stored in a SQLite file, shared between the processes of a server.
+    The oldest entries are evicted when there are more than max_entries, counters (incr) are never evicted.
+    """
+
+    def __init__(self, filename, max_entries=10000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.local = local()
+        self.writes = 0
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL, created REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (created)")
+
+    def connect(self):
+        # connections cannot be shared between threads or forked processes
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            if os.path.dirname(self.filename):
+                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            conn = self.local.conn = sqlite3.connect(self.filename, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self.connect().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] and row[1] < time.time()):
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=None):
+        now = time.time()
+        conn = self.connect()
+        conn.execute("INSERT OR REPLACE INTO cache (key, value, expires, created) VALUES (?, ?, ?, ?)",
+                     (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + timeout if timeout else None, now))
+        self.writes += 1
+        if self.writes % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        conn = self.connect()
+        conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+        # counters have no creation time
+        conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache WHERE created IS NOT NULL "
+                     "ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def add(self, key, value, timeout=None):
+        now = time.time()
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires IS NOT NULL AND expires < ?", (key, now))
+            cursor = conn.execute("INSERT OR IGNORE INTO cache (key, value, expires, created) VALUES (?, ?, ?, ?)",
+                                  (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + timeout if timeout else None, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount > 0
+
+    def delete(self, key):
+        self.connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = self.get(key) or 0
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires, created) VALUES (?, ?, NULL, NULL)",
+                         (key, pickle.dumps(value + 1)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value + 1
+
+    def clear(self):
+        self.connect().execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self.connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class RedisCache:
+    """Cache stored in Redis (requires the redis package). Eviction is left to the redis maxmemory policy."""
+
+    def __init__(self, url, prefix="hyperflask:"):
+        if redis is None:
+            raise RuntimeError("The redis package is required to use a redis cache")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        if value.isdigit():
+            return int(value) # counter
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=None):
+        self.client.set(self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=int(timeout) if timeout else None)
+
+    def add(self, key, value, timeout=None):
+        return bool(self.client.set(self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                                    ex=int(timeout) if timeout else None, nx=True))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+
+class TieredCache:
+    """Per-process LRU in front of a shared cache. Counters (incr) only live in the shared cache.
+    Local copies are kept at most local_timeout seconds so that deletions from other processes are seen.
+    """
+
+    def __init__(self, local_cache, shared_cache, local_timeout=None):
+        self.local_cache = local_cache
+        self.shared_cache = shared_cache
+        self.local_timeout = local_timeout
+
+    def get(self, key):
+        value = self.local_cache.get(key)
+        if value is None:
+            value = self.shared_cache.get(key)
+            if value is not None:
+                self.local_cache.set(key, value, self.local_timeout)
+        return value
+
+    def set(self, key, value, timeout=None):
+        self.local_cache.set(key, value, min(filter(None, (timeout, self.local_timeout)), default=None))
+        self.shared_cache.set(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        if not self.shared_cache.add(key, value, timeout):
+            return False
+        self.local_cache.set(key, value, min(filter(None, (timeout, self.local_timeout)), default=None))
+        return True
+
+    def delete(self, key):
+        self.local_cache.delete(key)
+        self.shared_cache.delete(key)
+
+    def incr(self, key):
+        return self.shared_cache.incr(key)
+
+    def clear(self):
+        self.local_cache.clear()
+        self.shared_cache.clear()
+
+
+def create_cache_store(backend=None, max_entries=1000, root_path=None, prefix="hyperflask:", local_timeout=None,
+                       shared_max_entries=10000):
+    """Creates a cache from a backend url: None or "memory" for a per-process LRU,
+    "sqlite:path/to/file.db" or "redis://..." for a shared cache (fronted by a per-process LRU).
+    """
+    local_cache = MemoryCache(max_entries)
+    if not backend or backend == "memory":
+        return local_cache
+    if backend.startswith("sqlite:"):
+        filename = backend[len("sqlite:"):]
+        if filename.startswith("//"):
+            filename = filename[2:]
+        if root_path and not os.path.isabs(filename):
+            filename = os.path.join(root_path, filename)
+        return TieredCache(local_cache, SQLiteCache(filename, shared_max_entries), local_timeout)
+    if backend.startswith(("redis://", "rediss://", "unix://")):
+        return TieredCache(local_cache, RedisCache(backend, prefix), local_timeout)
+    raise ValueError(f"Unknown cache backend '{backend}'")
@@ -0,0 +1,189 @@
+from flask.templating import Environment as BaseEnvironment
+from flask_configurator import Config as BaseConfig
+from flask_collections.collection import BaseCollection
+from contextvars import ContextVar
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import tempfile
+
+
+# set of (kind, name) tuples touched while rendering, None when not tracking
+_dependencies = ContextVar("hyperflask_dependencies", default=None)
+
+
+def track_dependency(kind, name):
+    deps = _dependencies.get()
+    if deps is not None:
+        deps.add((kind, name))
+
+
+@contextmanager
+def track_dependencies(collections=True):
+    """Collects the templates, files, collections, models and config keys used while rendering.
+    Dependencies are also added to the enclosing tracker, if any.
+    Tracking collections patches flask-collections and is not thread-safe.
+    """
+    deps = set()
+    outer = _dependencies.get()
+    token = _dependencies.set(deps)
+    try:
+        if collections:
+            with patch_collections():
+                yield deps
+        else:
+            yield deps
+    finally:
+        _dependencies.reset(token)
+        if outer is not None:
+            outer.update(deps)
+
+
+class Environment(BaseEnvironment):
+    def get_template(self, name, parent=None, globals=None):
+        template = super().get_template(name, parent, globals)
+        track_dependency("template", template.name)
+        return template
+
+    def select_template(self, names, parent=None, globals=None):
+        template = super().select_template(names, parent, globals)
+        track_dependency("template", template.name)
+        return template
+
+
+class Config(BaseConfig):
+    def __getitem__(self, key):
+        track_dependency("config", key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        track_dependency("config", key)
+        return super().get(key, default)
+
+
+@contextmanager
+def patch_collections():
+    # flask-collections has no hooks, wrap the access points only for the duration of the tracking
+    originals = {name: getattr(BaseCollection, name) for name in ("__iter__", "__len__", "page", "get", "__getitem__")}
+
+    def track_collection(name):
+        def wrapper(self, *args, **kwargs):
+            if name == "get":
+                track_dependency("collection_entry", f"{self.name}/{args[0]}")
+            elif name != "__getitem__" or isinstance(args[0], slice):
+                track_dependency("collection", self.name)
+            return originals[name](self, *args, **kwargs)
+        return wrapper
+
+    for name in originals:
+        setattr(BaseCollection, name, track_collection(name))
+    try:
+        yield
+    finally:
+        for name, func in originals.items():
+            setattr(BaseCollection, name, func)
+
+
+class DependencyFingerprints:
+    """Computes (and caches for the duration of a build) a hash representing the current state of a dependency.
+    The fingerprint is None when it cannot be computed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.cache = {}
+
+    def get(self, kind, name):
+        key = (kind, name)
+        if key not in self.cache:
+            try:
+                self.cache[key] = getattr(self, f"fingerprint_{kind}")(name)
+            except Exception:
+                self.cache[key] = None
+        return self.cache[key]
+
+    def fingerprint_template(self, name):
+        env = self.app.jinja_env
+        source, filename, _ = env.loader.get_source(env, name)
+        return hash_data(source)
+
+    def fingerprint_file(self, name):
+        with open(name, "rb") as f:
+            return hash_data(f.read())
+
+    def fingerprint_config(self, name):
+        return hash_data(repr(dict.get(self.app.config, name)))
+
+    def fingerprint_collection(self, name):
+        collection = self.app.collections.collections[name]
+        return hash_data(repr([serialize_collection_entry(e) for e in collection.entries]))
+
+    def fingerprint_collection_entry(self, name):
+        collection_name, slug = name.split("/", 1)
+        for entry in self.app.collections.collections[collection_name].entries:
+            if entry.slug == slug:
+                return hash_data(repr(serialize_collection_entry(entry)))
+
+    def fingerprint_code(self, path):
+        """Hash of all python files of the app, any change triggers a full rebuild."""
+        h = hashlib.blake2b(digest_size=16)
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d not in ("node_modules", "__pycache__"))
+            for filename in sorted(files):
+                if filename.endswith(".py"):
+                    with open(os.path.join(root, filename), "rb") as f:
+                        h.update(f.read())
+        return h.hexdigest()
+
+
+class BuildManifest:
+    """Dependencies and output hash of each frozen URL from the previous build."""
+
+    def __init__(self, filename, code_fingerprint=None, entries=None):
+        self.filename = filename
+        self.code_fingerprint = code_fingerprint
+        self.entries = entries or {}
+
+    @classmethod
+    def load(cls, filename):
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+            return cls(filename, data.get("code"), data.get("urls"))
+        except (OSError, ValueError):
+            return cls(filename)
+
+    def is_up_to_date(self, url, fingerprints):
+        entry = self.entries.get(url)
+        if not entry:
+            return False
+        for dep, fingerprint in entry["deps"].items():
+            kind, name = dep.split(":", 1)
+            # dependencies without a fingerprint (models or failures) cannot be compared and are always stale
+            if fingerprint is None or fingerprints.get(kind, name) != fingerprint:
+                return False
+        return True
+
+    def set(self, url, deps, fingerprints, content, url_for_calls=None):
+        self.entries[url] = {
+            "deps": {f"{kind}:{name}": fingerprints.get(kind, name) for kind, name in sorted(deps)},
+            "hash": hash_data(content),
+            "url_for_calls": url_for_calls or [],
+        }
+
+    def save(self):
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.filename)), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"code": self.code_fingerprint, "urls": self.entries}, f, default=str)
+        os.replace(tmpname, self.filename)
+
+
+def serialize_collection_entry(entry):
+    return (entry.slug, entry.content, entry.layout, sorted((k, repr(v)) for k, v in entry.props.items()))
+
+
+def hash_data(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
@@ -0,0 +1,76 @@
+from flask import current_app, has_app_context, has_request_context, g
+from flask_babel import get_locale
+from markupsafe import Markup
+from jinja2 import nodes
+from jinja2.ext import Extension
+import hashlib
+from .cache import create_cache_store
+from .dependencies import track_dependencies, track_dependency
+from .page_cache import NONCE_PLACEHOLDER
+from ..security import csp_nonce
+
+
+def get_fragment_cache(app=None):
+    app = app or current_app
+    cache = app.extensions.get("fragment_cache")
+    if cache is None:
+        cache = app.extensions["fragment_cache"] = create_cache_store(
+            app.config["FRAGMENT_CACHE_BACKEND"], app.config["FRAGMENT_CACHE_SIZE"], app.root_path,
+            "hyperflask:fragment:", app.config["FRAGMENT_CACHE_LOCAL_TIMEOUT"], app.config["FRAGMENT_CACHE_BACKEND_SIZE"])
+    return cache
+
+
+def make_fragment_cache_key(key, vary=None):
+    parts = [str(key)]
+    if has_request_context():
+        parts.append(str(get_locale() or ""))
+    if vary is not None:
+        parts.extend(map(str, vary if isinstance(vary, (list, tuple)) else [vary]))
+    return "fragment:" + hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=20).hexdigest()
+
+
+def invalidate_fragment(key, vary=None):
+    get_fragment_cache().delete(make_fragment_cache_key(key, vary))
+
+
+class CacheExtension(Extension):
+    """Caches the rendered content of a block:
+    {% cache "sidebar", ttl=300, vary=[request.path] %}...{% endcache %}
+    Keys are shared by all templates and include the current locale. The dependencies of the block
+    are replayed when it is served from the cache and its CSP nonce is replaced by the current one.
+    """
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        kwargs = []
+        while parser.stream.skip_if("comma"):
+            name = parser.stream.expect("name")
+            if name.value not in ("ttl", "vary"):
+                parser.fail(f"Unknown cache option '{name.value}'", name.lineno)
+            parser.stream.expect("assign")
+            kwargs.append(nodes.Keyword(name.value, parser.parse_expression()))
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(self.call_method("_cache", args, kwargs), [], [], body).set_lineno(lineno)
+
+    def _cache(self, key, caller, ttl=None, vary=None):
+        if not has_app_context() or not current_app.config["FRAGMENT_CACHE"]:
+            return caller()
+        cache = get_fragment_cache()
+        cache_key = make_fragment_cache_key(key, vary)
+        entry = cache.get(cache_key)
+        if not isinstance(entry, dict):
+            with track_dependencies(collections=False) as deps:
+                html = str(caller())
+            nonce = g.get("csp_nonce") if has_request_context() else None
+            entry = {"html": html.replace(nonce, NONCE_PLACEHOLDER.decode()) if nonce else html,
+                     "deps": sorted(deps), "nonce": bool(nonce and nonce in html)}
+            cache.set(cache_key, entry, ttl or current_app.config["FRAGMENT_CACHE_TIMEOUT"])
+            return Markup(html)
+        for kind, name in entry["deps"]:
+            track_dependency(kind, name)
+        if entry["nonce"]:
+            return Markup(entry["html"].replace(NONCE_PLACEHOLDER.decode(), csp_nonce()))
+        return Markup(entry["html"])
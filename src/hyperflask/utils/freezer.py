@@ -1,6 +1,19 @@
-from flask_frozen import Freezer as FlaskFreezer
+from flask import current_app, request, request_finished
+from flask_frozen import Freezer as FlaskFreezer, Page, walk_directory, patch_url_for, conditional_context
+from werkzeug.wrappers import Request
 from pathlib import Path
 from enum import Enum
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import suppress
+from unicodedata import normalize
+from threading import Lock, Thread
+import multiprocessing
+import hashlib
+import json
+import os
+import time
+from .dependencies import track_dependencies, DependencyFingerprints, BuildManifest
+from .static import precompress_app_folder, precompress_app_file, get_precompressed_encodings, send_precompressed_file, write_atomic
 
 
 class StaticMode(Enum):
@@ -9,7 +22,21 @@ class StaticMode(Enum):
     DYNAMIC = "dynamic"
 
 
+# response headers that are not stored in the frozen pages index
+FROZEN_PAGES_EXCLUDED_HEADERS = ("Content-Length", "Content-Encoding", "Transfer-Encoding", "Set-Cookie",
+                                 "Date", "ETag", "Last-Modified", "Vary")
+
+
 class Freezer(FlaskFreezer):
+    build_manifest = None
+    frozen_headers = None
+    revalidate_actor = None
+    index_lock = Lock()
+
+    def init_app(self, app):
+        super().init_app(app)
+        request_finished.connect(self._record_frozen_headers, app, weak=False)
+
     @property
     def root(self):
         return Path(self.app.config['FREEZER_DESTINATION'])
@@ -19,6 +46,231 @@ class Freezer(FlaskFreezer):
             return
         super()._check_endpoints(seen_endpoints)
 
+    def freeze_yield(self, processes=None, chunksize=None, incremental=None):
+        """Like Frozen-Flask's freeze_yield() but can shard URLs across a pool of processes
+        (FREEZER_PROCESSES). Each process renders its URLs using its own copy of the app.
+
+        In incremental mode (FREEZER_INCREMENTAL), the dependencies of each URL are recorded
+        in a build manifest and only URLs with changed dependencies are rendered again.
+        """
+        if incremental is None:
+            incremental = self.app.config.get('FREEZER_INCREMENTAL', False)
+        if incremental:
+            self.load_build_manifest()
+        self.frozen_headers = {}
+        try:
+            urls = []
+            for page in self._freeze_yield(processes, chunksize):
+                urls.append(page.url)
+                yield page
+            if self.build_manifest:
+                self.build_manifest.save()
+            if self.app.config['FREEZER_PAGES_INDEX']:
+                self.write_frozen_pages_index(urls)
+            if self.app.config['STATIC_PRECOMPRESS']:
+                precompress_app_folder(self.app, self.root)
+        finally:
+            self.build_manifest = None
+            self.frozen_headers = None
+
+    @property
+    def is_freezing(self):
+        return self.frozen_headers is not None
+
+    def _record_frozen_headers(self, sender, response, **kwargs):
+        if self.is_freezing and response.status_code == 200:
+            self.frozen_headers[request.path] = [(k, v) for k, v in response.headers.items()
+                                                 if k not in FROZEN_PAGES_EXCLUDED_HEADERS]
+
+    def write_frozen_pages_index(self, urls):
+        """Lists the frozen pages of @static endpoints with the headers of their response
+        so that they can be served directly by FrozenPages in HYBRID mode.
+        """
+        filename = self.root / self.app.config['FREEZER_PAGES_INDEX']
+        previous = load_frozen_pages_index(filename)
+        index = {}
+        for url in urls:
+            endpoint = self._match_endpoint(url)
+            view = self.app.view_functions.get(endpoint)
+            if getattr(view, '__freezer__', None) is not True:
+                continue
+            headers = self.frozen_headers.get(url)
+            if headers is None:
+                # not rendered during this build (incremental mode)
+                if url in previous:
+                    index[url] = previous[url]
+                continue
+            index[url] = {"path": self.urlpath_to_filepath(url), "endpoint": endpoint, "headers": headers,
+                          "revalidate": getattr(view, '__freezer_revalidate__', None) or self.app.config['FREEZER_REVALIDATE']}
+        self.root.mkdir(parents=True, exist_ok=True)
+        write_atomic(str(filename), json.dumps(index, indent=2).encode("utf-8"))
+
+    def load_build_manifest(self):
+        self.fingerprints = DependencyFingerprints(self.app)
+        self.build_manifest = BuildManifest.load(self.app.config['FREEZER_MANIFEST_FILE'])
+        code_fingerprint = self.fingerprints.fingerprint_code(self.app.root_path)
+        if self.build_manifest.code_fingerprint != code_fingerprint:
+            self.build_manifest = BuildManifest(self.build_manifest.filename, code_fingerprint)
+
+    def _build_one(self, url, last_modified=None):
+        if not self.build_manifest or self._is_static_url(url):
+            # static files are already skipped by Frozen-Flask using their modification time
+            return super()._build_one(url, last_modified)
+
+        path = self.root / normalize('NFC', self.urlpath_to_filepath(url))
+        if path.is_file() and self.build_manifest.is_up_to_date(url, self.fingerprints):
+            if self.log_url_for:
+                # pages discovered through url_for() in this page still need to be built
+                self.url_for_logger.logged_calls.extend(tuple(c) for c in self.build_manifest.entries[url]["url_for_calls"])
+            return path
+
+        logged_calls_before = len(self.url_for_logger.logged_calls)
+        with track_dependencies() as deps:
+            path = super()._build_one(url, last_modified)
+        url_for_calls = list(self.url_for_logger.logged_calls)[logged_calls_before:]
+        self.build_manifest.set(url, deps, self.fingerprints, path.read_bytes() if path.is_file() else b"", url_for_calls)
+        return path
+
+    def freeze_url(self, url):
+        """Renders a single URL again and atomically replaces its frozen file, its precompressed
+        variants and its entry in the frozen pages index.
+        """
+        with conditional_context(patch_url_for(self.app), self.app.config['FREEZER_RELATIVE_URLS']):
+            response = self.app.test_client().get(url, base_url=self.app.config['FREEZER_BASE_URL'],
+                                                  environ_overrides={"hyperflask.freezer": True})
+        if response.status_code != 200:
+            raise ValueError(f'Unexpected status {response.status!r} on URL {url}')
+
+        filename = self.urlpath_to_filepath(url)
+        path = self.root / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(str(path), response.data)
+        if self.app.config['STATIC_PRECOMPRESS']:
+            precompress_app_file(self.app, str(self.root), filename)
+
+        if self.app.config['FREEZER_PAGES_INDEX']:
+            with self.index_lock:
+                index_filename = self.root / self.app.config['FREEZER_PAGES_INDEX']
+                index = load_frozen_pages_index(index_filename)
+                headers = [[k, v] for k, v in response.headers.items() if k not in FROZEN_PAGES_EXCLUDED_HEADERS]
+                if url in index and index[url]["headers"] != headers:
+                    index[url]["headers"] = headers
+                    write_atomic(str(index_filename), json.dumps(index, indent=2).encode("utf-8"))
+        return path
+
+    def request_revalidation(self, url):
+        """Enqueues the regeneration of a frozen page unless one is already pending for this URL
+        (in any process). Returns whether it has been enqueued.
+        """
+        marker = self.root / ".revalidating" / hashlib.sha1(url.encode("utf-8")).hexdigest()
+        try:
+            marker.parent.mkdir(exist_ok=True)
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            with suppress(OSError):
+                if time.time() - marker.stat().st_mtime > self.app.config['FREEZER_REVALIDATE_TIMEOUT']:
+                    marker.unlink() # the previous regeneration did not complete, the next request will retry
+            return False
+        except OSError:
+            return False
+
+        if self.revalidate_actor:
+            self.revalidate_actor.send(url)
+        else:
+            Thread(target=self._revalidate_in_thread, args=(url,), daemon=True).start()
+        return True
+
+    def revalidate(self, url):
+        try:
+            self.freeze_url(url)
+        finally:
+            with suppress(OSError):
+                (self.root / ".revalidating" / hashlib.sha1(url.encode("utf-8")).hexdigest()).unlink()
+
+    def _revalidate_in_thread(self, url):
+        with self.app.app_context():
+            try:
+                self.revalidate(url)
+            except Exception:
+                self.app.logger.exception(f"Error while regenerating frozen page {url}")
+
+    def _match_endpoint(self, url):
+        try:
+            endpoint, _ = self.app.url_map.bind("localhost").match(url, method="GET")
+            return endpoint
+        except Exception:
+            return None
+
+    def _is_static_url(self, url):
+        endpoint = self._match_endpoint(url)
+        return endpoint is not None and (endpoint == "static" or endpoint.endswith(".static"))
+
+    def _freeze_yield(self, processes=None, chunksize=None):
+        processes = processes or self.app.config.get('FREEZER_PROCESSES')
+        if not processes or processes <= 1:
+            yield from super().freeze_yield()
+            return
+
+        chunksize = chunksize or self.app.config.get('FREEZER_CHUNKSIZE', 20)
+        self.root.mkdir(parents=True, exist_ok=True)
+        seen_urls = set()
+        seen_endpoints = set()
+        built_paths = set()
+
+        def add_urls(urls):
+            batch = []
+            for url, endpoint, last_modified in urls:
+                seen_endpoints.add(endpoint)
+                if url not in seen_urls:
+                    seen_urls.add(url)
+                    batch.append((url, last_modified))
+            return [batch[i:i + chunksize] for i in range(0, len(batch), chunksize)]
+
+        # generate the initial urls before starting processes so the app is not forked mid-request
+        batches = add_urls(self._generate_all_urls())
+
+        global _worker_freezer
+        _worker_freezer = self
+        start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        try:
+            with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context(start_method),
+                                     initializer=_init_freeze_worker) as pool:
+                pending = set(pool.submit(_freeze_urls, batch) for batch in batches)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pages, logged_calls, manifest_entries, frozen_headers = future.result()
+                        if self.build_manifest:
+                            self.build_manifest.entries.update(manifest_entries)
+                        self.frozen_headers.update(frozen_headers)
+                        for url, path in pages:
+                            built_paths.add(self.root / path)
+                            yield Page(url, Path(path))
+                        if logged_calls:
+                            for batch in add_urls(self._generate_urls_from_calls(logged_calls)):
+                                pending.add(pool.submit(_freeze_urls, batch))
+        finally:
+            _worker_freezer = None
+
+        self._check_endpoints(seen_endpoints)
+        if self.app.config['FREEZER_REMOVE_EXTRA_FILES']:
+            # Remove files from the previous build that are not here anymore.
+            ignore = self.app.config['FREEZER_DESTINATION_IGNORE']
+            previous_paths = set(Path(self.root / name) for name in walk_directory(self.root, ignore=ignore))
+            for extra_path in previous_paths - built_paths:
+                extra_path.unlink()
+                with suppress(OSError):
+                    extra_path.parent.rmdir()
+
+    def _generate_urls_from_calls(self, calls):
+        # reuse Frozen-Flask's url generation (url_for() and normalization) for url_for() calls logged in workers
+        url_generators = self.url_generators
+        self.url_generators = [lambda: calls]
+        try:
+            return list(self._generate_all_urls())
+        finally:
+            self.url_generators = url_generators
+
     def urlpath_to_filepath(self, path):
         """Convert URL path like /admin/ to file path like admin/index.html."""
         if path.endswith('/'):
@@ -30,11 +282,125 @@ class Freezer(FlaskFreezer):
         return path[1:]
 
 
-def static(func=None, values=None):
+_worker_freezer = None
+
+
+def _init_freeze_worker():
+    global _worker_freezer
+    if _worker_freezer is None:
+        # processes are not forked, the app needs to be created again
+        from ..cli import _create_app
+        _worker_freezer = _create_app().freezer
+        if _worker_freezer.app.config.get('FREEZER_INCREMENTAL', False):
+            _worker_freezer.load_build_manifest()
+    _worker_freezer.frozen_headers = {}
+
+
+def _freeze_urls(urls):
+    freezer = _worker_freezer
+    pages = []
+    for url, last_modified in urls:
+        path = freezer._build_one(url, last_modified)
+        pages.append((url, str(path.relative_to(freezer.root))))
+    logged_calls = list(freezer.url_for_logger.iter_calls()) if freezer.log_url_for else []
+    manifest_entries = {}
+    if freezer.build_manifest:
+        manifest_entries = {url: freezer.build_manifest.entries[url] for url, _ in urls if url in freezer.build_manifest.entries}
+    frozen_headers = {url: freezer.frozen_headers[url] for url, _ in urls if url in freezer.frozen_headers}
+    return pages, logged_calls, manifest_entries, frozen_headers
+
+
+class FrozenPages:
+    """WSGI middleware serving the frozen output of @static endpoints (as listed in the frozen
+    pages index) before the request reaches the app, so that routing and views are skipped.
+    Requests fall through to the app when the page is not frozen.
+    """
+
+    def __init__(self, app, wsgi_app, reload_interval=1):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.reload_interval = reload_interval
+        self.index = {}
+        self.index_mtime = None
+        self.checked_at = 0
+        self.lock = Lock()
+
+    @property
+    def root(self):
+        return os.path.abspath(self.app.config['FREEZER_DESTINATION'])
+
+    def get_index(self):
+        # the frozen output can be rebuilt while the app is running
+        if time.monotonic() - self.checked_at < self.reload_interval:
+            return self.index
+        with self.lock:
+            filename = os.path.join(self.root, self.app.config['FREEZER_PAGES_INDEX'])
+            mtime = (get_mtime(filename), get_mtime(os.path.join(self.root, self.app.config['STATIC_INTEGRITY_MANIFEST'] or "")))
+            if mtime != self.index_mtime:
+                self.index = load_frozen_pages_index(filename)
+                self.index_mtime = mtime
+                self.app.extensions.get("static_manifests", {}).pop(self.root, None)
+            self.checked_at = time.monotonic()
+        return self.index
+
+    def __call__(self, environ, start_response):
+        # query strings and htmx requests may change the output of the view
+        if environ["REQUEST_METHOD"] in ("GET", "HEAD") and not environ.get("QUERY_STRING") \
+           and "HTTP_HX_REQUEST" not in environ and "hyperflask.freezer" not in environ \
+           and not self.app.freezer.is_freezing:
+            entry = self.get_index().get(environ.get("PATH_INFO") or "/")
+            if entry:
+                response = self.make_response(environ, entry)
+                if response is not None:
+                    return response(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def make_response(self, environ, entry):
+        path = os.path.join(self.root, entry["path"])
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry.get("revalidate") and time.time() - stat.st_mtime > entry["revalidate"]:
+            # serve the stale page while it is regenerated in the background
+            self.app.freezer.request_revalidation(environ.get("PATH_INFO") or "/")
+        encodings = get_precompressed_encodings(self.root, entry["path"], stat, self.app)
+        response = send_precompressed_file(environ, path, encodings, Request(environ).accept_encodings,
+                                           response_class=self.app.response_class)
+        del response.headers["Content-Disposition"]
+        for key, value in entry["headers"]:
+            response.headers[key] = value
+        return response
+
+
+def get_mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+def revalidate_frozen_page(url):
+    current_app.freezer.revalidate(url)
+
+
+def load_frozen_pages_index(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def static(func=None, values=None, revalidate=None):
+    """Marks a view as frozen. With revalidate (in seconds), the frozen page is regenerated
+    in the background when it is requested and older than this (HYBRID mode only).
+    """
     if func is None:
-        return lambda f: static(f, values=values)
+        return lambda f: static(f, values=values, revalidate=revalidate)
     func.__freezer__ = True
     func.__freezer_values__ = values
+    func.__freezer_revalidate__ = revalidate
     return func
 
 
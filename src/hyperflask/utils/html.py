@@ -1,13 +1,91 @@
 from html_sanitizer import Sanitizer
 from markupsafe import Markup
 from flask import current_app
+from collections import OrderedDict
+from threading import Lock
+import hashlib
 
 
 def sanitize_html(html, **config):
     config = dict(current_app.config.get("HTML_SANITIZER_CONFIG", {}), **config)
-    sanitizer = Sanitizer(config)
-    return Markup(sanitizer.sanitize(html))
+    return Markup(get_sanitizer_registry().sanitize(html, config))
 
 
 def nl2br(value):
     return value.replace("\n", "<br>")
+
+
+def get_sanitizer_registry(app=None):
+    app = app or current_app
+    registry = app.extensions.get("html_sanitizer")
+    if registry is None:
+        registry = app.extensions["html_sanitizer"] = SanitizerRegistry(app.config.get("HTML_SANITIZER_CACHE_SIZE", 0))
+    return registry
+
+
+class SanitizerRegistry:
+    """Reuses Sanitizer instances per config and optionally keeps a bounded LRU cache
+    of sanitized output keyed by content hash and config.
+    """
+
+    def __init__(self, cache_size=0):
+        self.cache_size = cache_size
+        self.sanitizers = {}
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, config=None):
+        key = make_config_key(config or {})
+        sanitizer = self.sanitizers.get(key)
+        if sanitizer is None:
+            sanitizer = self.sanitizers[key] = Sanitizer(config)
+        return sanitizer
+
+    def sanitize(self, html, config=None):
+        config = config or {}
+        if not self.cache_size:
+            return self.get(config).sanitize(html)
+
+        config_key = make_config_key(config)
+        key = (hashlib.blake2b(html.encode("utf-8"), digest_size=16).digest(), config_key)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+            self.misses += 1
+
+        sanitizer = self.sanitizers.get(config_key)
+        if sanitizer is None:
+            sanitizer = self.sanitizers[config_key] = Sanitizer(config)
+        output = sanitizer.sanitize(html)
+
+        with self.lock:
+            self.cache[key] = output
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return output
+
+    def clear(self):
+        with self.lock:
+            self.sanitizers.clear()
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self):
+        return {"sanitizers": len(self.sanitizers), "cached": len(self.cache),
+                "hits": self.hits, "misses": self.misses}
+
+
+def make_config_key(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, make_config_key(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return frozenset(make_config_key(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return tuple(make_config_key(v) for v in value)
+    return value
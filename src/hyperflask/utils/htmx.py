@@ -2,6 +2,7 @@ from htmx_flask import request
 from htmx_flask import make_response
 from markupsafe import Markup
 from flask import get_flashed_messages, current_app, json
+import itertools
 import re
 
 
@@ -29,7 +30,23 @@ def htmx_oob(html, swap="outerHTML", target=None, wrap=True):
 
 
 def respond_with_htmx_oob(response, html, **kwargs):
-    response.set_data(htmx_oob(html, **kwargs) + response.get_data(as_text=True))
+    return prepend_response_data(response, htmx_oob(html, **kwargs))
+
+
+def prepend_response_data(response, data):
+    """Prepends data as an extra chunk in front of the response body without buffering it,
+    so that streamed responses stay streamed.
+    """
+    if not data or response.direct_passthrough:
+        return response
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if response.is_sequence:
+        response.response = [data, *response.response]
+    else:
+        response.response = itertools.chain([data], response.response)
+    if "Content-Length" in response.headers:
+        response.headers["Content-Length"] = str(int(response.headers["Content-Length"]) + len(data))
     return response
 
 
@@ -50,15 +67,18 @@ def add_hx_trigger(response, event, data=None):
 
 
 def respond_with_flash_messages(response, only_if_htmx=True, target="#flash-messages-toast"):
-    if only_if_htmx and not request.htmx:
+    if only_if_htmx and not request.htmx or response.direct_passthrough:
+        return response
+
+    flashes = get_flashed_messages(with_categories=True)
+    if not flashes:
         return response
 
     messages = []
-    for category, message in get_flashed_messages(with_categories=True):
+    for category, message in flashes:
         props = {"category": category, "caller": lambda: message}
         if current_app.config["FLASH_TOAST_REMOVE_AFTER"]:
             props["remove-me"] = current_app.config["FLASH_TOAST_REMOVE_AFTER"]
         messages.append(htmx_oob(current_app.macros.FlashMessage(**props), swap="beforestart", target=target))
 
-    response.set_data("\n".join(messages) + response.get_data(as_text=True))
-    return response
+    return prepend_response_data(response, "\n".join(messages))
@@ -3,14 +3,34 @@ from markupsafe import Markup
 import jinja2
 from jinja2.ext import Extension
 from flask import current_app
-from .html import sanitize_html
+from collections import OrderedDict
+from threading import Lock, local
+import hashlib
+import json
+import os
+from .html import sanitize_html, make_config_key
+from .static import write_atomic
 
 
 def render_markdown(input, safe=True, sanitize_config=None):
-    html = markdown.markdown(input, **current_app.config.get("MARKDOWN_OPTIONS", {}))
+    options = current_app.config.get("MARKDOWN_OPTIONS", {})
     if safe:
-        sanitize_config = dict(current_app.config.get("MARKDOWN_SANITIZER_CONFIG", {}), **(sanitize_config or {}))
-        return sanitize_html(html, **sanitize_config)
+        # the effective config (including the defaults merged by sanitize_html) is part of the cache key
+        sanitize_config = dict(current_app.config.get("HTML_SANITIZER_CONFIG", {}),
+                               **current_app.config.get("MARKDOWN_SANITIZER_CONFIG", {}), **(sanitize_config or {}))
+    renderer = get_markdown_renderer()
+
+    cache_key = renderer.make_cache_key(input, options, safe, sanitize_config)
+    if cache_key:
+        html = renderer.get_cached(cache_key)
+        if html is not None:
+            return Markup(html) if safe else html
+
+    html = renderer.convert(input, options)
+    if safe:
+        html = sanitize_html(html, **sanitize_config)
+    if cache_key:
+        renderer.set_cached(cache_key, str(html))
     return html
 
 
@@ -18,6 +38,136 @@ def jinja_markdown(input, **kwargs):
     return Markup(render_markdown(input, **kwargs))
 
 
+def get_markdown_renderer(app=None):
+    app = app or current_app
+    renderer = app.extensions.get("markdown_renderer")
+    if renderer is None:
+        cache_folder = app.config.get("MARKDOWN_CACHE_FOLDER")
+        if cache_folder:
+            cache_folder = os.path.join(app.root_path, cache_folder)
+        renderer = app.extensions["markdown_renderer"] = MarkdownRenderer(
+            app.config.get("MARKDOWN_CACHE_SIZE", 0), cache_folder, app.config.get("MARKDOWN_CACHE_FOLDER_SIZE", 10000))
+    return renderer
+
+
+class MarkdownRenderer:
+    """Keeps one Markdown instance per thread and per options (reset between uses)
+    and optionally caches rendered html in memory and on disk. The least recently used
+    files are removed when the cache folder holds more than cache_folder_size files.
+    """
+
+    def __init__(self, cache_size=0, cache_folder=None, cache_folder_size=10000):
+        self.cache_size = cache_size
+        self.cache_folder = cache_folder
+        self.cache_folder_size = cache_folder_size
+        self.writes = 0
+        self.instances = local()
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_instance(self, options):
+        key = make_config_key(options)
+        instances = getattr(self.instances, "md", None)
+        if instances is None:
+            instances = self.instances.md = {}
+        md = instances.get(key)
+        if md is None:
+            md = instances[key] = markdown.Markdown(**options)
+        return md
+
+    def convert(self, input, options=None):
+        md = self.get_instance(options or {})
+        try:
+            return md.convert(input)
+        finally:
+            md.reset()
+
+    def make_cache_key(self, input, options, safe=True, sanitize_config=None):
+        if not self.cache_size and not self.cache_folder:
+            return None
+        # keys are persisted on disk and must be stable between processes
+        h = hashlib.blake2b(input.encode("utf-8"), digest_size=16)
+        h.update(canonical_json([options, safe, sanitize_config or {}]).encode("utf-8"))
+        return h.hexdigest()
+
+    def get_cached(self, key):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+
+        html = None
+        if self.cache_folder:
+            filename = os.path.join(self.cache_folder, f"{key}.html")
+            try:
+                with open(filename, encoding="utf-8") as f:
+                    html = f.read()
+                os.utime(filename) # the modification time is used to evict the least recently used files
+            except FileNotFoundError:
+                pass
+
+        with self.lock:
+            if html is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._set_memory_cache(key, html)
+        return html
+
+    def set_cached(self, key, html):
+        self._set_memory_cache(key, html)
+        if self.cache_folder:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            write_atomic(os.path.join(self.cache_folder, f"{key}.html"), html.encode("utf-8"))
+            self.writes += 1
+            if self.cache_folder_size and self.writes % 100 == 0:
+                self.evict_folder()
+
+    def evict_folder(self):
+        try:
+            entries = [e for e in os.scandir(self.cache_folder) if e.name.endswith(".html")]
+            if len(entries) <= self.cache_folder_size:
+                return
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:len(entries) - self.cache_folder_size]:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass # removed by another process
+
+    def _set_memory_cache(self, key, html):
+        if not self.cache_size:
+            return
+        with self.lock:
+            self.cache[key] = html
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self):
+        return {"cached": len(self.cache), "hits": self.hits, "misses": self.misses}
+
+
+def canonical_json(value):
+    def normalize(value):
+        if isinstance(value, dict):
+            return {str(k): normalize(v) for k, v in value.items()}
+        if isinstance(value, (set, frozenset)):
+            return sorted((normalize(v) for v in value), key=repr)
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+    return json.dumps(normalize(value), sort_keys=True, default=str)
+
+
 class MarkdownExtension(Extension):
     tags = {"markdown"}
 
@@ -0,0 +1,203 @@
+from flask import current_app, json
+from flask_mercure_sse.ext import as_topic
+from collections import OrderedDict
+from threading import Lock, Timer
+from requests.adapters import HTTPAdapter
+import atexit
+import os
+import requests
+import weakref
+
+
+# publishers of all apps, flushed once at exit without keeping their app alive
+_publishers = weakref.WeakSet()
+
+
+def get_mercure_publisher(app=None):
+    app = app or current_app
+    publisher = app.extensions.get("mercure_publisher")
+    if publisher is None:
+        publisher = app.extensions["mercure_publisher"] = MercurePublisher(app)
+    return publisher
+
+
+def mercure_publish_later(topic, data=None, **kwargs):
+    """Like mercure_publish() but queues the update: see MercurePublisher."""
+    get_mercure_publisher().publish(topic, data, **kwargs)
+
+
+def publish_mercure_updates(updates):
+    """Actor posting a batch of rendered updates to the hub."""
+    get_mercure_publisher().send_updates(updates)
+
+
+class MercurePublisher:
+    """Queues mercure updates and coalesces them per topic and object during a debounce window (only the
+    last update of an object on a topic is sent). Payloads are rendered when the queue is flushed, once per object even when it is
+    published to multiple topics. Updates are posted in batches over a pooled keep-alive connection or,
+    when an actor is set, sent to a worker.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.debounce = app.config["MERCURE_PUBLISH_DEBOUNCE"]
+        self.batch_size = app.config["MERCURE_PUBLISH_BATCH_SIZE"]
+        self.pool_size = app.config["MERCURE_PUBLISH_POOL_SIZE"]
+        self.actor = None
+        self.pending = OrderedDict()
+        self.lock = Lock()
+        self.flush_lock = Lock() # flushes are serialized to preserve ordering and reuse the same connection
+        self.timer = None
+        self.session = None
+        self.session_pid = None
+        _publishers.add(self)
+
+    @property
+    def sse(self):
+        return self.app.extensions["mercure_sse"].instance
+
+    def publish(self, topic, data=None, private=False, id=None, type=None, retry=None):
+        """Queues an update. topic can be a list of topics, data defaults to the topic object."""
+        if data is None:
+            data = topic
+            if not hasattr(topic, "__mercure_sse_topic__"):
+                topic = topic.__class__.__name__
+        topics = topic if isinstance(topic, (list, tuple)) else [topic]
+
+        identity = self.get_identity(data)
+        with self.lock:
+            for topic in topics:
+                topic = as_topic(topic)
+                key = (topic, bool(private), identity)
+                self.pending.pop(key, None) # the latest update is sent last
+                self.pending[key] = (data, {"id": id, "type": type, "retry": retry})
+            if self.debounce and self.timer is None:
+                self.timer = Timer(self.debounce, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if not self.debounce:
+            self.flush()
+
+    def get_identity(self, data):
+        from ..model import Model
+
+        if isinstance(data, Model):
+            pk = data.__class__.__mapper__.get_primary_key(data)
+            if pk is not None:
+                return (data.__class__, pk)
+        # the pending queue keeps a reference to the data so its id is not reused
+        return id(data)
+
+    def publish_model(self, obj):
+        """Queues the object for its own topic and, when topics are per object, the topic of its model."""
+        topics = [obj.__mercure_sse_topic__]
+        model_topic = obj.__class__.__mercure_sse_topic__
+        if model_topic not in topics:
+            topics.append(model_topic)
+        self.publish(topics, obj)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, OrderedDict()
+                if self.timer:
+                    self.timer.cancel()
+                    self.timer = None
+            if pending:
+                self._flush(pending)
+
+    def _flush(self, pending):
+        # flushes run in a timer thread: templates may still use request, url_for() or csp_nonce()
+        with self.app.test_request_context():
+            try:
+                updates = self.render_updates(pending)
+            except Exception:
+                self.app.logger.exception(f"Error while rendering {len(pending)} mercure updates")
+                return
+            for i in range(0, len(updates), self.batch_size):
+                batch = updates[i:i + self.batch_size]
+                try:
+                    if self.actor and not self.sse.hub:
+                        self.actor.send(batch)
+                    else:
+                        self.send_updates(batch)
+                except Exception:
+                    self.app.logger.exception(f"Error while publishing {len(batch)} mercure updates")
+
+    def render_updates(self, pending):
+        type_is_topic = self.app.extensions["mercure_sse"].type_is_topic
+        payloads = {} # object id -> (object, rendered payload)
+        renderers = {}
+        updates = []
+        for (topic, private, _), (data, options) in pending.items():
+            if id(data) not in payloads:
+                # keeping a reference to the object ensures its id is not reused during the loop
+                try:
+                    payloads[id(data)] = (data, self.render_payload(data, renderers))
+                except Exception:
+                    self.app.logger.exception(f"Error while rendering mercure update for topic {topic}")
+                    payloads[id(data)] = (data, None)
+            if payloads[id(data)][1] is None:
+                continue
+
+            update = {"topic": topic, "data": payloads[id(data)][1]}
+            if private:
+                update["private"] = "on"
+            type = options["type"]
+            if type is True or (type is None and type_is_topic):
+                type = topic
+            if type:
+                update["type"] = type
+            if options["id"]:
+                update["id"] = options["id"]
+            if options["retry"]:
+                update["retry"] = options["retry"]
+            updates.append(update)
+        return updates
+
+    def render_payload(self, data, renderers):
+        from ..model import Model
+
+        if isinstance(data, Model) and data.__class__.__mercure_sse_data__ is Model.__mercure_sse_data__:
+            if data.__class__ not in renderers:
+                renderers[data.__class__] = data.__class__.get_renderer()
+            return str(renderers[data.__class__](data))
+        if hasattr(data, "__mercure_sse_data__"):
+            return data.__mercure_sse_data__()
+        if isinstance(data, (str, bytes)):
+            return data
+        return json.dumps(data)
+
+    def send_updates(self, updates):
+        sse = self.sse
+        if sse.hub:
+            for update in updates:
+                sse.hub.publish(update["topic"], update["data"], bool(update.get("private")), update.get("id"),
+                                update.get("type"), update.get("retry"))
+            return
+
+        # the hub protocol accepts a single update per request, they are sent over the same connection
+        session = self.get_session()
+        hub_url = sse.hub_base_url(public=False)
+        for update in updates:
+            try:
+                session.post(hub_url, data=update, timeout=10).raise_for_status()
+            except requests.RequestException as e:
+                self.app.logger.warning(f"Could not publish mercure update to topic {update['topic']}: {e}")
+
+    def get_session(self):
+        # connections cannot be shared with forked processes
+        if self.session is None or self.session_pid != os.getpid():
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+            self.session.headers["Authorization"] = f"Bearer {self.app.extensions['mercure_sse'].publisher_jwt}"
+            self.session_pid = os.getpid()
+        return self.session
+
+
+@atexit.register
+def flush_publishers():
+    for publisher in list(_publishers):
+        publisher.flush()
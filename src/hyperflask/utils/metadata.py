@@ -1,8 +1,10 @@
 from flask import current_app, json
 from flask_configurator.config import deep_update_dict
+from flask_configurator.reloader import config_reloaded
 from jinja_super_macros import html_tag
 from markupsafe import Markup
 import inspect
+import copy
 
 
 DEFAULT_METADATA = {
@@ -15,33 +17,89 @@ LINK_METADATA = ["icon", "shortcut icon", "apple-touch-icon", "apple-touch-icon-
 
 
 def metadata_tags(metadata=None, title_template=None, **kwargs):
-    _metadata = dict(DEFAULT_METADATA)
-    _metadata.update(current_app.config.get('SITE_METADATA', {}))
-    deep_update_dict(_metadata, metadata or {})
-    deep_update_dict(_metadata, kwargs)
+    site = get_site_metadata(current_app)
+    _metadata = {}
+    for overrides in (metadata or {}, kwargs):
+        for name in overrides:
+            if name not in _metadata and name in site.metadata:
+                _metadata[name] = copy.deepcopy(site.metadata[name])
+        deep_update_dict(_metadata, overrides)
+
+    if "_baseurl" in _metadata:
+        # urls of site-wide tags depend on the base url, regenerate everything
+        _metadata = dict(site.metadata, **_metadata)
+    all_metadata = dict(site.metadata, **_metadata)
     tags = []
 
     if title_template is None:
         title_template = current_app.config.get('SITE_TITLE', None)
-    title = generate_title(_metadata.pop("title", None), title_template)
+    title = generate_title(_metadata.pop("title") if "title" in _metadata else site.metadata.get("title"), title_template)
     if title:
         tags.append(f"<title>{title}</title>")
 
+    if not any(name in site.tags for name in _metadata):
+        if site.fragment:
+            tags.append(site.fragment)
+    else:
+        for name, site_tags in site.tags.items():
+            if name in _metadata:
+                tags.extend(generate_metadata_tags(name, _metadata[name], all_metadata))
+            elif site_tags:
+                tags.append(site_tags)
+
     for name, value in _metadata.items():
-        if name.startswith("_"):
-            continue
-        if name in METADATA_GENERATORS:
-            rv = METADATA_GENERATORS[name](name, value, _metadata)
-        else:
-            rv = metadata_tag(name, value, _metadata)
-        if inspect.isgenerator(rv) or isinstance(rv, (list, tuple)):
-            tags.extend(list(rv))
-        else:
-            tags.append(rv)
+        if name not in site.tags:
+            tags.extend(generate_metadata_tags(name, value, all_metadata))
 
     return Markup("\n".join(tags))
 
 
+class SiteMetadata:
+    """Site-wide metadata with its tags pre-rendered."""
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.tags = {}
+        for name, value in metadata.items():
+            if name == "title":
+                continue
+            self.tags[name] = "\n".join(generate_metadata_tags(name, value, metadata))
+        self.fragment = Markup("\n".join(t for t in self.tags.values() if t))
+
+
+def get_site_metadata(app):
+    config = app.config.get('SITE_METADATA', {})
+    cached = app.extensions.get('site_metadata')
+    if cached is None or cached[0] is not config:
+        metadata = dict(DEFAULT_METADATA)
+        metadata.update(copy.deepcopy(config))
+        cached = app.extensions['site_metadata'] = (config, SiteMetadata(metadata))
+    return cached[1]
+
+
+@config_reloaded.connect
+def clear_site_metadata_cache(app):
+    app.extensions.pop('site_metadata', None)
+
+
+def generate_metadata_tags(name, value, metadata):
+    if name.startswith("_"):
+        return []
+    if name in METADATA_GENERATORS:
+        rv = METADATA_GENERATORS[name](name, value, metadata)
+    else:
+        rv = metadata_tag(name, value, metadata)
+    return list(_flatten_tags(rv))
+
+
+def _flatten_tags(rv):
+    if inspect.isgenerator(rv) or isinstance(rv, (list, tuple)):
+        for tag in rv:
+            yield from _flatten_tags(tag)
+    elif rv is not None:
+        yield rv
+
+
 def generate_title(title, title_template=None):
     if isinstance(title, dict) and "absolute" in title:
         return title["absolute"]
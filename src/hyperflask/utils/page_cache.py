@@ -0,0 +1,213 @@
+from flask import current_app, request, g
+from flask.globals import request_ctx
+from flask_babel import get_locale
+from sqlorm import Model as BaseModel, Session, get_current_session
+import functools
+import hashlib
+import re
+import yaml
+from .cache import create_cache_store
+from .dependencies import track_dependencies, track_dependency
+from ..security import csp_nonce
+
+
+HTMX_HEADERS = ("HX-Request", "HX-Boosted", "HX-Target", "HX-Trigger")
+EXCLUDED_HEADERS = ("Content-Length", "Set-Cookie", "Date", "ETag")
+NONCE_PLACEHOLDER = b"\0hyperflask-csp-nonce\0"
+
+
+def cache_page(func=None, timeout=None, vary=None, tags=None, ignore_session=False):
+    """Caches the response of a view. The cache key includes the URL, the locale, the htmx headers
+    and the vary items (header names or callables). Responses are tagged with the models queried
+    while rendering (plus tags, a list or a function receiving the view arguments) and are
+    invalidated when one of these models is saved or deleted.
+    """
+    if func is None:
+        return lambda f: cache_page(f, timeout=timeout, vary=vary, tags=tags, ignore_session=ignore_session)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return get_page_cache().serve(func, args, kwargs, timeout=timeout, vary=vary,
+                                      tags=tags(**kwargs) if callable(tags) else tags,
+                                      ignore_session=ignore_session)
+    return wrapper
+
+
+def get_page_cache(app=None):
+    app = app or current_app
+    cache = app.extensions.get("page_cache")
+    if cache is None:
+        cache = app.extensions["page_cache"] = PageCache(app)
+    return cache
+
+
+def get_session():
+    # flask >= 3.1 marks the session as accessed each time the session proxy is used
+    ctx = request_ctx._get_current_object()
+    return getattr(ctx, "_session", None) or ctx.session
+
+
+def parse_page_cache_option(frontmatter, is_module=True):
+    """Reads the cache option of a page: a "# cache = <seconds|true>" comment in python
+    frontmatters or a "cache" key in yaml frontmatters.
+    """
+    if not frontmatter:
+        return None
+    if is_module:
+        m = re.search(r"^#\s*cache\s*=\s*(\w+)\s*$", frontmatter, re.MULTILINE | re.I)
+        value = m.group(1) if m else None
+    else:
+        try:
+            value = (yaml.safe_load(frontmatter) or {}).get("cache")
+        except (yaml.YAMLError, AttributeError):
+            return None
+    if isinstance(value, str):
+        if value.isdigit():
+            return int(value)
+        return value.lower() == "true" or None
+    return value or None
+
+
+class PageCache:
+    """Caches responses in a per-process LRU, optionally in front of a shared backend (PAGE_CACHE_BACKEND).
+    Tags are invalidated by incrementing their version in the shared backend: entries store the version
+    of their tags and are ignored once one of them changed. Model changes invalidate tags once their
+    transaction is committed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = app.config["PAGE_CACHE"]
+        self.timeout = app.config["PAGE_CACHE_TIMEOUT"]
+        self.vary = app.config["PAGE_CACHE_VARY"]
+        self.store = create_cache_store(app.config["PAGE_CACHE_BACKEND"], app.config["PAGE_CACHE_SIZE"],
+                                        app.root_path, "hyperflask:page:", app.config["PAGE_CACHE_LOCAL_TIMEOUT"])
+        self.tags_store = getattr(self.store, "shared_cache", self.store)
+        self.hits = 0
+        self.misses = 0
+        for signal in (BaseModel.after_insert, BaseModel.after_update, BaseModel.after_delete):
+            signal.connect(self.on_model_changed, weak=False)
+        Session.after_commit.connect(self.on_session_committed, weak=False)
+        Session.after_rollback.connect(self.on_session_rolled_back, weak=False)
+
+    def serve(self, func, args, kwargs, timeout=None, vary=None, tags=None, ignore_session=False):
+        if not self.enabled or request.method not in ("GET", "HEAD"):
+            return func(*args, **kwargs)
+
+        vary = list(self.vary) + list(vary or [])
+        key = self.make_key(vary)
+        entry = self.store.get(key)
+        if entry is not None and self.is_valid(entry):
+            self.hits += 1
+            # the freezer tracks the dependencies of pages served from the cache too
+            for kind, name in entry.get("deps", []):
+                track_dependency(kind, name)
+            return self.make_response(entry)
+        self.misses += 1
+
+        session = get_session()
+        session_accessed = session.accessed
+        session.accessed = False
+        # models are only known after rendering: if any tag is invalidated while rendering, the page
+        # may have been rendered from outdated data and is not cached
+        generation = self.tags_store.get("tag:*")
+        with track_dependencies(collections=False) as deps:
+            response = current_app.make_response(func(*args, **kwargs))
+        cacheable = self.is_cacheable(response, session, ignore_session)
+        session.accessed = session.accessed or session_accessed
+
+        self.add_vary_headers(response, vary)
+        if cacheable:
+            tags = set(tags or []) | set(name for kind, name in deps if kind == "model")
+            versions = {tag: self.tags_store.get(f"tag:{tag}") or 0 for tag in tags}
+            cacheable = self.tags_store.get("tag:*") == generation
+        if cacheable:
+            body = response.get_data()
+            nonce = g.get("csp_nonce")
+            if nonce:
+                # the nonce is replaced by a new one each time the entry is served
+                body = body.replace(nonce.encode("utf-8"), NONCE_PLACEHOLDER)
+            entry = {
+                "status": response.status_code,
+                "headers": [(k, v) for k, v in response.headers.items() if k not in EXCLUDED_HEADERS],
+                "body": body,
+                "tags": versions,
+                "deps": sorted(deps),
+                "nonce": bool(nonce),
+                "etag": hashlib.blake2b(body, digest_size=16).hexdigest(),
+            }
+            self.store.set(key, entry, timeout or self.timeout)
+            if not nonce:
+                response.set_etag(entry["etag"])
+        return response.make_conditional(request)
+
+    def make_key(self, vary):
+        parts = [request.host, request.full_path, str(get_locale() or "")]
+        parts.extend(request.headers.get(header, "") for header in HTMX_HEADERS)
+        for item in vary:
+            parts.append(str(item() if callable(item) else request.headers.get(item, "")))
+        return "page:" + hashlib.blake2b("\0".join(parts).encode("utf-8"), digest_size=20).hexdigest()
+
+    def is_valid(self, entry):
+        return all((self.tags_store.get(f"tag:{tag}") or 0) == version for tag, version in entry["tags"].items())
+
+    def is_cacheable(self, response, session, ignore_session=False):
+        if response.status_code != 200 or response.is_streamed or "Set-Cookie" in response.headers:
+            return False
+        if response.cache_control.private or response.cache_control.no_store:
+            return False
+        # pages using the session are specific to the user
+        return not session.modified and (ignore_session or not session.accessed)
+
+    def make_response(self, entry):
+        if entry["nonce"]:
+            # no etag: a browser revalidating its copy would keep the previous nonce in its html
+            body = entry["body"].replace(NONCE_PLACEHOLDER, csp_nonce().encode("utf-8"))
+            return current_app.response_class(body, entry["status"], entry["headers"])
+        response = current_app.response_class(entry["body"], entry["status"], entry["headers"])
+        response.set_etag(entry["etag"])
+        return response.make_conditional(request)
+
+    def add_vary_headers(self, response, vary):
+        response.vary.update(HTMX_HEADERS[:1])
+        response.vary.update(item for item in vary if isinstance(item, str))
+
+    def invalidate_tags(self, *tags):
+        # the generation is incremented first so that pages rendering meanwhile see the change
+        self.tags_store.incr("tag:*")
+        for tag in tags:
+            self.tags_store.incr(f"tag:{tag}")
+
+    def on_model_changed(self, sender, obj=None, **kwargs):
+        tags = [sender.__name__]
+        if obj is not None:
+            pk = sender.__mapper__.get_primary_key(obj)
+            if pk is not None:
+                tags.append(f"{sender.__name__}/{pk}")
+        session = get_current_session()
+        if session is None:
+            self.invalidate_tags(*tags)
+            return
+        # pages rendered before the commit would still see the previous data
+        if not hasattr(session, "page_cache_tags"):
+            session.page_cache_tags = set()
+        session.page_cache_tags.update(tags)
+
+    def on_session_committed(self, session):
+        tags = getattr(session, "page_cache_tags", None)
+        if tags:
+            session.page_cache_tags = set()
+            self.invalidate_tags(*tags)
+
+    def on_session_rolled_back(self, session):
+        if getattr(session, "page_cache_tags", None):
+            session.page_cache_tags = set()
+
+    def clear(self):
+        self.store.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
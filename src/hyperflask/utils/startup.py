@@ -0,0 +1,82 @@
+from threading import RLock
+from contextlib import contextmanager
+import time
+
+
+class StartupProfiler:
+    """Records how long each step of the app startup takes."""
+
+    def __init__(self):
+        self.timings = []
+        self.last_checkpoint = time.perf_counter()
+
+    def checkpoint(self, name, kind="init"):
+        now = time.perf_counter()
+        self.timings.append((kind, name, now - self.last_checkpoint))
+        self.last_checkpoint = now
+
+    @contextmanager
+    def measure(self, name, kind="init"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((kind, name, time.perf_counter() - start))
+            self.last_checkpoint = time.perf_counter()
+
+    def as_dict(self):
+        return [{"kind": kind, "name": name, "duration": duration} for kind, name, duration in self.timings]
+
+
+class LazyExtensions(dict):
+    """Extensions dict where some extensions are only initialized the first time
+    their state is accessed from app.extensions.
+    """
+
+    def __init__(self, app, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.app = app
+        self.initializers = {}
+        self.lock = RLock()
+
+    def register_lazy(self, key, initializer):
+        self.initializers[key] = initializer
+
+    def initialize(self, key):
+        with self.lock:
+            initializer = self.initializers.pop(key, None)
+            if initializer:
+                with self.app.startup_profiler.measure(key, "lazy init"):
+                    initializer(self.app)
+
+    def __missing__(self, key):
+        if key not in self.initializers:
+            raise KeyError(key)
+        self.initialize(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.initializers
+
+    def get(self, key, default=None):
+        if key in self.initializers:
+            self.initialize(key)
+        return dict.get(self, key, default)
+
+
+def parse_importtime(output):
+    """Aggregates the self time reported by `python -X importtime` per top-level package.
+    Returns a list of (package, seconds) sorted by decreasing time.
+    """
+    packages = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_time, _, name = line[len("import time:"):].split("|", 2)
+            self_time = int(self_time)
+        except ValueError:
+            continue # header line
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + self_time / 1e6
+    return sorted(packages.items(), key=lambda p: p[1], reverse=True)
@@ -0,0 +1,268 @@
+from flask import current_app, request, abort
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import stat
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# supported encodings and the suffix of their precompressed file, in order of preference
+ENCODINGS = {"br": ".br", "zstd": ".zst", "gzip": ".gz"}
+COMPRESSIBLE_EXTENSIONS = (".html", ".htm", ".css", ".js", ".mjs", ".json", ".map", ".svg", ".xml",
+                           ".txt", ".md", ".csv", ".ico", ".wasm", ".ttf", ".otf", ".eot")
+
+
+def available_encodings(encodings=None):
+    """Filters encodings for which the compression library is installed."""
+    available = []
+    for encoding in encodings if encodings is not None else ENCODINGS:
+        if encoding == "gzip" or (encoding == "br" and brotli) or (encoding == "zstd" and zstandard):
+            available.append(encoding)
+        elif encoding in ENCODINGS:
+            logger.debug(f"Skipping {encoding} precompression, the compression library is not installed")
+    return available
+
+
+def compress(data, encoding):
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    raise ValueError(f"Unknown encoding {encoding}")
+
+
+def precompress_folder(folder, encodings=None, min_size=1024, manifest_filename=".integrity.json",
+                       extensions=COMPRESSIBLE_EXTENSIONS):
+    """Writes compressed siblings (.br, .zst, .gz) of the compressible files of a folder and
+    an integrity manifest listing the hash and available encodings of each file.
+    Files unchanged since the last run (according to the previous manifest) are skipped.
+    """
+    encodings = available_encodings(encodings)
+    previous = load_static_manifest(os.path.join(folder, manifest_filename)) if manifest_filename else {}
+    suffixes = tuple(ENCODINGS.values())
+    manifest = {}
+
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for filename in files:
+            path = os.path.join(root, filename)
+            relpath = os.path.relpath(path, folder).replace(os.sep, "/")
+            if relpath == manifest_filename:
+                continue
+            if filename.endswith(suffixes) and (relpath.rsplit(".", 1)[0] in previous or os.path.exists(path.rsplit(".", 1)[0])):
+                continue # precompressed variant
+
+            stat = os.stat(path)
+            entry = previous.get(relpath)
+            if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size \
+               and all(os.path.exists(path + ENCODINGS[e]) for e in entry["encodings"]):
+                manifest[relpath] = entry
+                continue
+
+            manifest[relpath] = _precompress_file(path, encodings, min_size, extensions)
+
+    for relpath in set(previous) - set(manifest):
+        # the original file has been removed
+        for encoding in previous[relpath]["encodings"]:
+            path = os.path.join(folder, relpath + ENCODINGS[encoding])
+            if os.path.exists(path):
+                os.unlink(path)
+
+    if manifest_filename:
+        write_atomic(os.path.join(folder, manifest_filename), json.dumps(manifest, indent=2).encode("utf-8"))
+    return manifest
+
+
+def precompress_file(folder, filename, encodings=None, min_size=1024, manifest_filename=".integrity.json",
+                     extensions=COMPRESSIBLE_EXTENSIONS):
+    """Precompresses a single file of the folder and updates its entry in the integrity manifest."""
+    entry = _precompress_file(os.path.join(folder, filename), available_encodings(encodings), min_size, extensions)
+    if manifest_filename:
+        # concurrent updates may lose an entry, the file is then served uncompressed until the next build
+        manifest_path = os.path.join(folder, manifest_filename)
+        manifest = load_static_manifest(manifest_path)
+        manifest[filename.replace(os.sep, "/")] = entry
+        write_atomic(manifest_path, json.dumps(manifest, indent=2).encode("utf-8"))
+    return entry
+
+
+def _precompress_file(path, encodings, min_size, extensions):
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    entry = {
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "integrity": "sha384-" + base64.b64encode(hashlib.sha384(data).digest()).decode("ascii"),
+        "encodings": {},
+    }
+    compressible = path.endswith(extensions) and len(data) >= min_size
+    for encoding, suffix in ENCODINGS.items():
+        if compressible and encoding in encodings:
+            compressed = compress(data, encoding)
+            if len(compressed) < len(data) * 0.95:
+                write_atomic(path + suffix, compressed)
+                entry["encodings"][encoding] = len(compressed)
+                continue
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+    return entry
+
+
+def precompress_app_file(app, folder, filename):
+    return precompress_file(folder, filename, app.config["STATIC_PRECOMPRESS"], app.config["STATIC_PRECOMPRESS_MIN_SIZE"],
+                            app.config["STATIC_INTEGRITY_MANIFEST"])
+
+
+def precompress_app_folder(app, folder):
+    return precompress_folder(folder, app.config["STATIC_PRECOMPRESS"], app.config["STATIC_PRECOMPRESS_MIN_SIZE"],
+                              app.config["STATIC_INTEGRITY_MANIFEST"])
+
+
+def load_static_manifest(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_static_manifest(folder, app=None):
+    """Integrity manifest of a folder, loaded once (reloaded on each call in debug mode)."""
+    app = app or current_app
+    if not app.config["STATIC_INTEGRITY_MANIFEST"]:
+        return {}
+    manifests = app.extensions.setdefault("static_manifests", {})
+    if app.debug or folder not in manifests:
+        manifests[folder] = load_static_manifest(os.path.join(folder, app.config["STATIC_INTEGRITY_MANIFEST"]))
+    return manifests[folder]
+
+
+def negotiate_encoding(encodings, accept_encodings=None):
+    """Picks the encoding with the highest quality in Accept-Encoding, using our order of preference for ties."""
+    if accept_encodings is None:
+        accept_encodings = request.accept_encodings
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        if encoding in encodings:
+            quality = accept_encodings.quality(encoding)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+    return best
+
+
+def is_immutable_asset(filename, app=None):
+    """Whether the filename contains a content hash (eg. as generated by esbuild)."""
+    app = app or current_app
+    pattern = app.config["STATIC_IMMUTABLE_PATTERN"]
+    return bool(pattern and re.search(pattern, filename))
+
+
+def get_precompressed_encodings(folder, filename, stat, app=None):
+    """Encodings available for a file of the folder, according to its integrity manifest when up to date."""
+    entry = get_static_manifest(folder, app).get(filename.replace(os.sep, "/"))
+    if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+        return list(entry["encodings"])
+    if not entry:
+        path = os.path.join(folder, filename)
+        return [e for e, suffix in ENCODINGS.items() if os.path.isfile(path + suffix)]
+    return [] # the manifest is stale
+
+
+def send_static(folder, filename, max_age=None):
+    """Sends a file from the folder, using its precompressed variant when accepted by the client.
+    Responses use wsgi.file_wrapper (or X-Sendfile when USE_X_SENDFILE is enabled), support
+    conditional and range requests and are cached forever when the filename contains a hash.
+    """
+    path = safe_join(folder, filename)
+    if path is None:
+        abort(404)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+
+    immutable = is_immutable_asset(filename)
+    if immutable:
+        max_age = current_app.config["STATIC_IMMUTABLE_MAX_AGE"]
+    elif max_age is None:
+        max_age = current_app.get_send_file_max_age(filename)
+
+    response = send_precompressed_file(request.environ, path, get_precompressed_encodings(folder, filename, stat),
+                                       request.accept_encodings, max_age=max_age,
+                                       use_x_sendfile=current_app.config["USE_X_SENDFILE"],
+                                       response_class=current_app.response_class)
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
+def send_precompressed_file(environ, path, encodings, accept_encodings, mimetype=None, **kwargs):
+    """Like werkzeug's send_file() but sends the best precompressed variant of the file.
+    Does not need a request context.
+    """
+    encoding = negotiate_encoding(encodings, accept_encodings) if encodings else None
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    # the filename and type are the ones of the original file, only the encoding changes
+    kwargs.setdefault("download_name", os.path.basename(path))
+    response = send_file(path + ENCODINGS[encoding] if encoding else path, environ, mimetype=mimetype,
+                         conditional=True, etag=True, **kwargs)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if encodings:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def write_atomic(filename, data, mode="wb"):
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+        # temporary files are only readable by their owner, files are usually served by another user:
+        # replaced files keep their mode, new files get the default one
+        try:
+            os.chmod(tmpname, stat.S_IMODE(os.stat(filename).st_mode))
+        except FileNotFoundError:
+            os.chmod(tmpname, 0o666 & ~UMASK)
+        os.replace(tmpname, filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+
+def get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# read once at import as os.umask() cannot be read without changing it for all threads
+UMASK = get_umask()